@@ -1,169 +1,351 @@
-import requests
+import asyncio
+import logging
+import httpx
 import xml.etree.ElementTree as ET
-import re
-from datetime import date, datetime
+import time
+from cache import TTLCache
+from datetime import date, datetime, timedelta
+from metrics import CACHES, Counter, Gauge, Histogram
+from workers import run_cpu_timed
+from store import StoredForecast
+from forecast import DailyForecast, Forecast, HourlyForecast, Wind, parse_float, parse_int
+from localization import get_sky_state_description
+
+logger = logging.getLogger(__name__)
+
+REQUEST_DURATION = Histogram('otempo_aemet_request_duration_seconds', 'Time spent requesting forecasts to Aemet, including retries', ['product'])
+REQUESTS_IN_FLIGHT = Gauge('otempo_aemet_requests_in_flight', 'Requests to Aemet running')
+REQUEST_ERRORS = Counter('otempo_aemet_request_errors_total', 'Failed requests to Aemet, including the retried ones', ['reason'])
+NOT_MODIFIED = Counter('otempo_aemet_not_modified_total', 'Forecasts revalidated without changes (304)', ['product'])
+STORE_HITS = Counter('otempo_aemet_store_hits_total', 'Forecasts loaded from the disk store without requesting Aemet', ['product'])
+STORE_REPARSES = Counter('otempo_aemet_store_reparses_total', 'Stored forecasts parsed again from the XML after a snapshot version change', ['product'])
+PARSE_DURATION = Histogram('otempo_aemet_parse_duration_seconds', 'Time spent parsing the Aemet forecasts', ['product'])
 
 class Aemet:
   BASE_URL = 'https://www.aemet.es'
 
-  # Description in Spanish (es) and Galician (gal) for each Aemet icon code.
-  # If the code contains a 'n' at the end, it means that it is night. Night description are not included in this JSON.
-  # The night description is the same as the day description, but with a 'noche' at the end. Example: 'Despejado' -> 'Despejado noche'
-  # Source: https://www.aemet.es/es/eltiempo/prediccion/espana/ayuda
-  SKY_STATE_CODES_DESCRIPTION = {
-    11: {'es': 'Despejado', 'gal': 'Despexado'},
-    12: {'es': 'Poco nuboso', 'gal': 'Pouco nubrado'},
-    13: {'es': 'Intervalos nubosos', 'gal': 'Intervalos nubrados'},
-    14: {'es': 'Nuboso', 'gal': 'Nubrado'},
-    15: {'es': 'Muy nuboso', 'gal': 'Moi nubrado'},
-    16: {'es': 'Cubierto', 'gal': 'Cuberto'},
-    17: {'es': 'Nubes altas', 'gal': 'Nubes altas'},
-    23: {'es': 'Intervalos nubosos con lluvia', 'gal': 'Intervalos nubrados con choiva'},
-    24: {'es': 'Nuboso con lluvia', 'gal': 'Nubrado con choiva'},
-    25: {'es': 'Muy nuboso con lluvia', 'gal': 'Moi nubrado con choiva'},
-    26: {'es': 'Cubierto con lluvia', 'gal': 'Cuberto con choiva'},
-    33: {'es': 'Intervalos nubosos con nieve', 'gal': 'Intervalos nubrados con neve'},
-    34: {'es': 'Nuboso con nieve', 'gal': 'Nubrado con neve'},
-    35: {'es': 'Muy nuboso con nieve', 'gal': 'Moi nubrado con neve'},
-    36: {'es': 'Cubierto con nieve', 'gal': 'Cuberto con neve'},
-    43: {'es': 'Intervalos nubosos con lluvia escasa', 'gal': 'Intervalos nubrados con choiva escasa'},
-    44: {'es': 'Nuboso con lluvia escasa', 'gal': 'Nubrado con choiva escasa'},
-    45: {'es': 'Muy nuboso con lluvia escasa', 'gal': 'Moi nubrado con choiva escasa'},
-    46: {'es': 'Cubierto con lluvia escasa', 'gal': 'Cuberto con choiva escasa'},
-    51: {'es': 'Intervalos nubosos con tormenta', 'gal': 'Intervalos nubrados con tormenta'},
-    52: {'es': 'Nuboso con tormenta', 'gal': 'Nubrado con tormenta'},
-    53: {'es': 'Muy nuboso con tormenta', 'gal': 'Moi nubrado con tormenta'},
-    54: {'es': 'Cubierto con tormenta', 'gal': 'Cuberto con tormenta'},
-    61: {'es': 'Intervalos nubosos con tormenta y lluvia escasa', 'gal': 'Intervalos nubrados con tormenta e choiva escasa'},
-    62: {'es': 'Nuboso con tormenta y lluvia escasa', 'gal': 'Nubrado con tormenta e choiva escasa'},
-    63: {'es': 'Muy nuboso con tormenta y lluvia escasa', 'gal': 'Moi nubrado con tormenta e choiva escasa'},
-    64: {'es': 'Cubierto con tormenta y lluvia escasa', 'gal': 'Cuberto con tormenta e choiva escasa'},
-    71: {'es': 'Intervalos nubosos con nieve escasa', 'gal': 'Intervalos nubrados con neve escasa'},
-    72: {'es': 'Nuboso con nieve escasa', 'gal': 'Nubrado con neve escasa'},
-    73: {'es': 'Muy nuboso con nieve escasa', 'gal': 'Moi nubrado con neve escasa'},
-    74: {'es': 'Cubierto con nieve escasa', 'gal': 'Cuberto con neve escasa'},
-    81: {'es': 'Niebla', 'gal': 'Néboa'},
-    82: {'es': 'Bruma', 'gal': 'Brétema'},
-    83: {'es': 'Calima', 'gal': ''},
+  # HTTP client settings. All the requests share the same connection pool, so the
+  # connections to Aemet are kept alive between requests.
+  TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+  MAX_CONNECTIONS = 20
+  MAX_KEEPALIVE_CONNECTIONS = 10
+  # Maximum number of requests to Aemet running at the same time
+  MAX_CONCURRENT_REQUESTS = 20
+  # Retries for network errors and 5xx responses, waiting RETRY_BACKOFF * 2^attempt seconds
+  MAX_RETRIES = 3
+  RETRY_BACKOFF = 0.5
+
+  # Forecast cache settings. Parsed forecasts are cached by product and municipality during
+  # CACHE_TTL seconds, but they expire earlier when Aemet is expected to publish a new version
+  # (UPDATE_INTERVAL after the `elaborado` time of the cached forecast). If that time has already
+  # passed, the forecast is only cached during CACHE_MIN_TTL seconds.
+  CACHE_TTL = 30 * 60
+  CACHE_MIN_TTL = 5 * 60
+  CACHE_MAX_SIZE = 1000
+  UPDATE_INTERVAL = {
+    'daily': timedelta(hours=6),
+    'hourly': timedelta(hours=2),
   }
 
-  def get_daily_forecast(municipality, forecast_date = date.today()):
-    url = f'{Aemet.BASE_URL}/xml/municipios/localidad_{municipality}.xml'
-    # Make the request
-    response = requests.get(url)
-    data = ET.fromstring(response.text)
-    return Aemet.__parse_daily_forecast(data, forecast_date)
+  # Aemet XML paths for each forecast product
+  PRODUCT_PATHS = {
+    'daily': '/xml/municipios/localidad_{}.xml',
+    'hourly': '/xml/municipios_h/localidad_h_{}.xml',
+  }
+
+  # Size of the chunks fed to the XML parser
+  PARSER_CHUNK_SIZE = 16 * 1024
+
+  __client = None
+  __semaphore = None
+  __cache = None
+  # On-disk store of the downloaded forecasts (store.ForecastStore), disabled if None
+  __store = None
+
+  # Root fields with the location data
+  __HEADER_FIELDS = {'nombre': 'location', 'provincia': 'province', 'elaborado': 'updated_at'}
+
+  def get_client():
+    if Aemet.__client is None or Aemet.__client.is_closed:
+      Aemet.__client = httpx.AsyncClient(
+        base_url=Aemet.BASE_URL,
+        timeout=Aemet.TIMEOUT,
+        limits=httpx.Limits(
+          max_connections=Aemet.MAX_CONNECTIONS,
+          max_keepalive_connections=Aemet.MAX_KEEPALIVE_CONNECTIONS,
+        ),
+      )
+    return Aemet.__client
+
+  def get_cache():
+    if Aemet.__cache is None:
+      Aemet.__cache = TTLCache(max_size=Aemet.CACHE_MAX_SIZE, ttl=Aemet.CACHE_TTL)
+    return Aemet.__cache
+
+  def reserve_cache(entries):
+    # Make room for `entries` forecasts on top of CACHE_MAX_SIZE, so the forecasts prefetched for
+    # the daily report are not evicted by the rest of requests before the report is sent
+    Aemet.get_cache().max_size = Aemet.CACHE_MAX_SIZE + entries
+
+  def set_store(store):
+    Aemet.__store = store
+
+  async def close():
+    if Aemet.__client is not None:
+      await Aemet.__client.aclose()
+      Aemet.__client = None
+
+  # The day forecasts are None if the day is not included in the Aemet forecast
+  async def get_daily_forecast(municipality, forecast_date=None):
+    forecast = await Aemet.get_forecast('daily', municipality)
+    return Aemet.__get_day_forecast(forecast, forecast_date)
+
+  async def get_hourly_forecast(municipality, forecast_date=None):
+    forecast = await Aemet.get_forecast('hourly', municipality)
+    return Aemet.__get_day_forecast(forecast, forecast_date)
 
-  def get_hourly_forecast(municipality, forecast_date = date.today()):
-    url = f'{Aemet.BASE_URL}/xml/municipios_h/localidad_h_{municipality}.xml'
+  async def get_forecast_range(municipality, start=None, days=7):
+    # Daily forecasts from `start` (today by default), up to `days` days. The Aemet daily XML
+    # contains a week, so all of them come from the same download.
+    forecast = await Aemet.get_forecast('daily', municipality)
+    start = Aemet.__to_date(start or date.today())
+    return [
+      forecast.days[forecast_date]
+      for forecast_date in (start + timedelta(days=i) for i in range(days))
+      if forecast_date in forecast.days
+    ]
+
+  async def get_forecast(product, municipality):
+    # Get the forecast of all the days from the cache, or request it to Aemet
+    async def fetch():
+      forecast = await Aemet.__request_forecast(product, municipality)
+      return forecast, Aemet.__get_cache_ttl(product, forecast.updated_at)
+    return await Aemet.get_cache().get_or_fetch((product, municipality), fetch)
+
+  async def prefetch_forecast(product, municipality, min_ttl):
+    # Request the forecast and keep it in the cache during `min_ttl` seconds at least. The request
+    # goes through the cache, so if the forecast is already being requested it waits for it.
+    async def fetch():
+      forecast = await Aemet.__request_forecast(product, municipality)
+      return forecast, max(min_ttl, Aemet.__get_cache_ttl(product, forecast.updated_at))
+    cache = Aemet.get_cache()
+    cache.invalidate((product, municipality))
+    forecast = await cache.get_or_fetch((product, municipality), fetch)
+    # The request may have been started by other caller, with a shorter TTL
+    cache.set((product, municipality), forecast, max(min_ttl, Aemet.__get_cache_ttl(product, forecast.updated_at)))
+    return forecast
+
+  async def __request_forecast(product, municipality):
+    # Use the stored forecast if it is recent enough, otherwise revalidate it
+    stored_forecast = None
+    headers = {}
+    if Aemet.__store is not None:
+      stored_forecast = await asyncio.to_thread(Aemet.__store.load, product, municipality)
+    if stored_forecast is not None and stored_forecast.forecast is None:
+      # The snapshot is from other version of the forecast classes, parse the stored XML again
+      content = await asyncio.to_thread(Aemet.__store.load_xml, product, municipality)
+      if content is None:
+        stored_forecast = None
+      else:
+        STORE_REPARSES.inc(product)
+        stored_forecast.forecast = await Aemet.__parse(product, content)
+        await asyncio.to_thread(Aemet.__store.save, product, municipality, stored_forecast)
+    if stored_forecast is not None:
+      age = time.time() - stored_forecast.fetched_at
+      if age < Aemet.__get_cache_ttl(product, stored_forecast.forecast.updated_at):
+        STORE_HITS.inc(product)
+        return stored_forecast.forecast
+      if stored_forecast.etag:
+        headers['If-None-Match'] = stored_forecast.etag
+      if stored_forecast.last_modified:
+        headers['If-Modified-Since'] = stored_forecast.last_modified
     # Make the request
-    response = requests.get(url)
-    data = ET.fromstring(response.text)
-    return Aemet.__parse_hourly_forecast(data, forecast_date)
+    with REQUEST_DURATION.time(product):
+      response = await Aemet.__fetch(Aemet.PRODUCT_PATHS[product].format(municipality), headers)
+    if response.status_code == 304 and stored_forecast is not None:
+      # Not modified, there is nothing to parse
+      NOT_MODIFIED.inc(product)
+      stored_forecast.fetched_at = time.time()
+      await asyncio.to_thread(Aemet.__store.save, product, municipality, stored_forecast)
+      return stored_forecast.forecast
+    forecast = await Aemet.__parse(product, response.content)
+    if Aemet.__store is not None:
+      stored_forecast = StoredForecast(
+        forecast=forecast,
+        etag=response.headers.get('ETag'),
+        last_modified=response.headers.get('Last-Modified'),
+        fetched_at=time.time(),
+      )
+      await asyncio.to_thread(Aemet.__store.save, product, municipality, stored_forecast, response.content)
+    return forecast
 
-  def get_sky_state_description(code, language='gal'):
-    if code is None:
-      return ''
-    code = int(re.sub('n', '', code))
-    return Aemet.SKY_STATE_CODES_DESCRIPTION[code][language]
-
-  def __parse_daily_forecast(data, forecast_date):
-    forecast_data = {}
-    # Get location data
-    forecast_data['location'] = data.find('nombre').text
-    forecast_data['province'] = data.find('provincia').text
-    forecast_data['updated_at'] = data.find('elaborado').text
-    # Get the forecast for today
+  async def __parse(product, content):
+    # Parsing is CPU-bound, it runs in the worker pool. Only the parsing is timed, not the queue.
+    forecast, seconds = await run_cpu_timed(f'parse_{product}', Aemet.parse_forecast, product, content)
+    PARSE_DURATION.observe(product, value=seconds)
+    return forecast
+
+  def parse_forecast(product, content, forecast_dates=None):
+    # Parse the raw XML incrementally, keeping only the days in `forecast_dates` (all of them if
+    # it is None). Each day is cleared once it has been parsed and the parser stops as soon as
+    # all the requested days are found.
+    parse_day = Aemet.__parse_daily_forecast if product == 'daily' else Aemet.__parse_hourly_forecast
+    if forecast_dates is not None:
+      forecast_dates = {Aemet.__to_date(forecast_date).isoformat() for forecast_date in forecast_dates}
+    forecast = Forecast()
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    depth = 0
+    prediction = None
+    for chunk in Aemet.__iter_chunks(content):
+      parser.feed(chunk)
+      for event, element in parser.read_events():
+        if event == 'start':
+          depth += 1
+          if depth == 2 and element.tag == 'prediccion':
+            prediction = element
+          continue
+        depth -= 1
+        # Get location data
+        if depth == 1 and element.tag in Aemet.__HEADER_FIELDS:
+          setattr(forecast, Aemet.__HEADER_FIELDS[element.tag], element.text)
+        elif depth == 2 and element.tag == 'dia':
+          day = element.attrib.get('fecha')
+          if forecast_dates is None or day in forecast_dates:
+            forecast.days[date.fromisoformat(day)] = parse_day(forecast, element)
+          # Free the parsed day
+          element.clear()
+          if prediction is not None:
+            prediction.remove(element)
+          # The rest of the document is not needed, it is discarded without closing the parser
+          if forecast_dates is not None and len(forecast.days) == len(forecast_dates):
+            return forecast
+    parser.close()
+    return forecast
+
+  def __iter_chunks(content):
+    for start in range(0, len(content), Aemet.PARSER_CHUNK_SIZE):
+      yield content[start:start + Aemet.PARSER_CHUNK_SIZE]
+
+  def __to_date(forecast_date):
     if isinstance(forecast_date, datetime):
-      forecast_date = forecast_date.date()
-    today_data = data.find('prediccion').find(f'.//dia[@fecha="{forecast_date.isoformat()}"]')
+      return forecast_date.date()
+    return forecast_date
+
+  def __get_day_forecast(forecast, forecast_date):
+    # The day forecasts already carry the location data
+    return forecast.days.get(Aemet.__to_date(forecast_date or date.today()))
+
+  def get_sky_state_description(code, language='gal'):
+    return get_sky_state_description(code, language)
+
+  def __get_cache_ttl(product, updated_at):
+    try:
+      next_update = datetime.fromisoformat(updated_at) + Aemet.UPDATE_INTERVAL[product]
+    except (TypeError, ValueError):
+      return Aemet.CACHE_MIN_TTL
+    remaining = (next_update - datetime.now()).total_seconds()
+    return max(Aemet.CACHE_MIN_TTL, min(Aemet.CACHE_TTL, remaining))
+
+  async def __fetch(path, headers=None):
+    if Aemet.__semaphore is None:
+      Aemet.__semaphore = asyncio.Semaphore(Aemet.MAX_CONCURRENT_REQUESTS)
+    async with Aemet.__semaphore:
+      attempt = 0
+      while True:
+        try:
+          REQUESTS_IN_FLIGHT.inc()
+          try:
+            response = await Aemet.get_client().get(path, headers=headers)
+          finally:
+            REQUESTS_IN_FLIGHT.dec()
+          # 304 is the answer to a conditional request for a forecast that hasn't changed
+          if response.status_code != 304:
+            response.raise_for_status()
+          return response
+        except httpx.HTTPError as error:
+          REQUEST_ERRORS.inc(str(error.response.status_code) if isinstance(error, httpx.HTTPStatusError) else type(error).__name__)
+          # Client errors (4xx) won't be fixed by retrying
+          retryable = not isinstance(error, httpx.HTTPStatusError) or error.response.status_code >= 500
+          if not retryable or attempt >= Aemet.MAX_RETRIES:
+            raise
+          delay = Aemet.RETRY_BACKOFF * 2 ** attempt
+          logger.warning(f'Aemet request to {path} failed ({error!r}), retrying in {delay}s')
+          await asyncio.sleep(delay)
+          attempt += 1
+
+  def __parse_daily_forecast(forecast, today_data):
+    forecast_data = DailyForecast(
+      date=date.fromisoformat(today_data.attrib['fecha']),
+      location=forecast.location,
+      province=forecast.province,
+      updated_at=forecast.updated_at,
+    )
+    # The days at the end of the week don't have periods, their values are for the whole day
     # Get sky state
-    forecast_data['sky_state'] = {}
     for estado_cielo in today_data.findall('estado_cielo'):
-      forecast_data['sky_state'][estado_cielo.attrib['periodo']] = {
-        'description': estado_cielo.attrib['descripcion'],
-        'sky_code': estado_cielo.text,
-      }
+      forecast_data.sky_state[estado_cielo.attrib.get('periodo', '00-24')] = estado_cielo.text
     # Get max and min temperature
-    forecast_data['temperature'] = {}
     temperature_data = today_data.find('temperatura')
-    forecast_data['temperature']['max'] = temperature_data.find('maxima').text
-    forecast_data['temperature']['min'] = temperature_data.find('minima').text
-    forecast_data['temperature']['hourly'] = {}
+    forecast_data.temperature_max = parse_int(temperature_data.findtext('maxima'))
+    forecast_data.temperature_min = parse_int(temperature_data.findtext('minima'))
     for temperature in temperature_data.findall('dato'):
-      forecast_data['temperature']['hourly'][temperature.attrib['hora']] = temperature.text
+      forecast_data.temperature[int(temperature.attrib['hora'])] = parse_int(temperature.text)
     # Get sensation temperature
-    forecast_data['temperature_sensation'] = {}
     temp_sens_data = today_data.find('sens_termica')
-    forecast_data['temperature_sensation']['max'] = temp_sens_data.find('maxima').text
-    forecast_data['temperature_sensation']['min'] = temp_sens_data.find('minima').text
-    forecast_data['temperature_sensation']['hourly'] = {}
+    forecast_data.temperature_sensation_max = parse_int(temp_sens_data.findtext('maxima'))
+    forecast_data.temperature_sensation_min = parse_int(temp_sens_data.findtext('minima'))
     for temperature_sensation in temp_sens_data.findall('dato'):
-      forecast_data['temperature_sensation']['hourly'][temperature_sensation.attrib['hora']] = temperature_sensation.text
+      forecast_data.temperature_sensation[int(temperature_sensation.attrib['hora'])] = parse_int(temperature_sensation.text)
     # Get precipitation probability
-    forecast_data['rain_probability'] = {}
     for rain_probability in today_data.findall('prob_precipitacion'):
-      forecast_data['rain_probability'][rain_probability.attrib['periodo']] = rain_probability.text
+      forecast_data.rain_probability[rain_probability.attrib.get('periodo', '00-24')] = parse_int(rain_probability.text)
     # Get wind
-    forecast_data['wind'] = {}
     for wind in today_data.findall('viento'):
-      forecast_data['wind'][wind.attrib['periodo']] = {
-        'direction': wind.find('direccion').text,
-        'speed': wind.find('velocidad').text,
-      }
+      forecast_data.wind[wind.attrib.get('periodo', '00-24')] = Wind(
+        direction=wind.findtext('direccion'),
+        speed=parse_int(wind.findtext('velocidad')),
+      )
     # Get snow qouta
-    forecast_data['snow_quota'] = {}
     for cota_nieve_prov in today_data.findall('cota_nieve_prov'):
-      forecast_data['snow_quota'][cota_nieve_prov.attrib['periodo']] = cota_nieve_prov.text
-    # Return JSON
+      forecast_data.snow_quota[cota_nieve_prov.attrib.get('periodo', '00-24')] = parse_int(cota_nieve_prov.text)
     return forecast_data
 
-  def __parse_hourly_forecast(data, forecast_date):
-    forecast_data = {}
-    # Get location data
-    forecast_data['location'] = data.find('nombre').text
-    forecast_data['province'] = data.find('provincia').text
-    forecast_data['updated_at'] = data.find('elaborado').text
-    # Get the forecast for today
-    if isinstance(forecast_date, datetime):
-      forecast_date = forecast_date.date()
-    today_data = data.find('prediccion').find(f'.//dia[@fecha="{forecast_date.isoformat()}"]')
+  def __parse_hourly_forecast(forecast, today_data):
+    forecast_data = HourlyForecast(
+      date=date.fromisoformat(today_data.attrib['fecha']),
+      location=forecast.location,
+      province=forecast.province,
+      updated_at=forecast.updated_at,
+    )
     # Get sunrise and sunset
-    forecast_data['sunrise'] = today_data.attrib['orto']
-    forecast_data['sunset'] = today_data.attrib['ocaso']
+    forecast_data.sunrise = today_data.attrib['orto']
+    forecast_data.sunset = today_data.attrib['ocaso']
     # Get sky state
-    forecast_data['sky_state'] = {}
     for estado_cielo in today_data.findall('estado_cielo'):
-      forecast_data['sky_state'][estado_cielo.attrib['periodo']] = {
-        'description': estado_cielo.attrib['descripcion'],
-        'sky_code': estado_cielo.text,
-      }
+      forecast_data.sky_state[int(estado_cielo.attrib['periodo'])] = estado_cielo.text
     # Get rain values
-    forecast_data['rain'] = {}
     for rain in today_data.findall('precipitacion'):
-      forecast_data['rain'][rain.attrib['periodo']] = rain.text
+      forecast_data.rain[int(rain.attrib['periodo'])] = parse_float(rain.text)
     # Get rain probability
-    forecast_data['rain_probability'] = {}
     for rain_probability in today_data.findall('prob_precipitacion'):
-      forecast_data['rain_probability'][rain_probability.attrib['periodo']] = rain_probability.text
+      forecast_data.rain_probability[rain_probability.attrib['periodo']] = parse_int(rain_probability.text)
     # Get temperature
-    forecast_data['temperature'] = {}
     for temperature in today_data.findall('temperatura'):
-      forecast_data['temperature'][temperature.attrib['periodo']] = temperature.text
+      forecast_data.temperature[int(temperature.attrib['periodo'])] = parse_int(temperature.text)
     # Get temperature sensation
-    forecast_data['temperature_sensation'] = {}
     for temperature_sensation in today_data.findall('sens_termica'):
-      forecast_data['temperature_sensation'][temperature_sensation.attrib['periodo']] = temperature_sensation.text
+      forecast_data.temperature_sensation[int(temperature_sensation.attrib['periodo'])] = parse_int(temperature_sensation.text)
     # Get storm probability
-    forecast_data['storm_probability'] = {}
     for storm_probability in today_data.findall('prob_tormenta'):
-      forecast_data['storm_probability'][storm_probability.attrib['periodo']] = storm_probability.text
+      forecast_data.storm_probability[storm_probability.attrib['periodo']] = parse_int(storm_probability.text)
     # Get wind
-    forecast_data['wind'] = {}
     for wind in today_data.findall('viento'):
-      forecast_data['wind'][wind.attrib['periodo']] = {
-        'direction': wind.find('direccion').text,
-        'speed': wind.find('velocidad').text,
-      }
-    # Return JSON
+      hour = int(wind.attrib['periodo'])
+      forecast_data.wind_direction[hour] = wind.findtext('direccion')
+      forecast_data.wind_speed[hour] = parse_int(wind.findtext('velocidad'))
+    # Get wind gusts
+    for wind_gust in today_data.findall('racha_max'):
+      forecast_data.wind_gust[int(wind_gust.attrib['periodo'])] = parse_int(wind_gust.text)
     return forecast_data
+
+CACHES.register('aemet_forecasts', Aemet.get_cache)
@@ -0,0 +1,111 @@
+import asyncio
+import bisect
+from datetime import timedelta
+import pymongo
+
+# Unit of each metric that can be watched. The descriptions are in localization.MESSAGES.
+ALERT_UNITS = {'rain': 'mm', 'storm': '%', 'wind': 'km/h'}
+# Hours checked after the current one
+DEFAULT_WINDOW_HOURS = 6
+
+# Hourly forecast period of the storm probability for each hour ('0208' covers 02h to 07h...). The
+# '2002' period covers 20h to 02h of the next day, so hours 0 and 1 use the period of the day before.
+STORM_PERIODS = ['2002'] * 2 + ['0208'] * 6 + ['0814'] * 6 + ['1420'] * 6 + ['2002'] * 4
+
+def get_hourly_value(forecast, metric, moment):
+  if metric == 'storm' and moment.hour < 2:
+    day_forecast = forecast.days.get(moment.date() - timedelta(days=1))
+  else:
+    day_forecast = forecast.days.get(moment.date())
+  if day_forecast is None:
+    return None
+  if metric == 'rain':
+    return day_forecast.rain[moment.hour]
+  if metric == 'storm':
+    return day_forecast.storm_probability.get(STORM_PERIODS[moment.hour])
+  if metric == 'wind':
+    gust = day_forecast.wind_gust[moment.hour]
+    return gust if gust is not None else day_forecast.wind_speed[moment.hour]
+  raise ValueError(f'Unknown alert metric: {metric}')
+
+def get_window_value(forecast, metric, start, hours):
+  # Value of the metric in the `hours` hours from `start`, which may include the next day: the
+  # total amount of rain, and the maximum storm probability and wind speed
+  values = []
+  for offset in range(hours):
+    value = get_hourly_value(forecast, metric, start + timedelta(hours=offset))
+    if value is not None:
+      values.append(value)
+  if not values:
+    return None
+  if metric == 'rain':
+    return round(sum(values), 1)
+  return max(values)
+
+def evaluate_alerts(forecast, alert_groups, now):
+  # Return the (alert, forecast value) pairs triggered for a municipality. `alert_groups` maps
+  # (metric, window) to the alerts sorted by threshold, so the value is computed once per group and
+  # the triggered alerts (threshold below the value) are found with a binary search.
+  triggered = []
+  start = now.replace(minute=0, second=0, microsecond=0)
+  for (metric, window), alerts in alert_groups.items():
+    value = get_window_value(forecast, metric, start, window)
+    if value is None:
+      continue
+    thresholds = [alert['threshold'] for alert in alerts]
+    for alert in alerts[:bisect.bisect_left(thresholds, value)]:
+      triggered.append((alert, value))
+  return triggered
+
+class AlertStore:
+  # Alert subscriptions, stored in MongoDB next to the daily report subscriptions.
+  # pymongo is synchronous, so the queries run in a thread to avoid blocking the event loop.
+  def __init__(self, client, database='apscheduler', collection='alerts'):
+    self.collection = client[database][collection]
+
+  async def setup(self):
+    def create_indexes():
+      self.collection.create_index([
+        ('municipality_code', pymongo.ASCENDING),
+        ('metric', pymongo.ASCENDING),
+        ('window', pymongo.ASCENDING),
+        ('threshold', pymongo.ASCENDING),
+      ])
+      self.collection.create_index('chat_id')
+    await asyncio.to_thread(create_indexes)
+
+  async def add(self, chat_id, municipality_code, municipality_name, metric, threshold, window=DEFAULT_WINDOW_HOURS):
+    await asyncio.to_thread(
+      self.collection.update_one,
+      {'chat_id': chat_id, 'municipality_code': municipality_code, 'metric': metric},
+      {'$set': {'municipality_name': municipality_name, 'threshold': threshold, 'window': window, 'notified_until': None}},
+      upsert=True,
+    )
+
+  async def remove(self, chat_id):
+    await asyncio.to_thread(self.collection.delete_many, {'chat_id': chat_id})
+
+  async def get_pending_alerts(self, now):
+    # Return {municipality code: {(metric, window): [alerts sorted by threshold]}} with the alerts
+    # not notified recently
+    def query():
+      pending_alerts = {}
+      cursor = self.collection.find(
+        {'$or': [{'notified_until': None}, {'notified_until': {'$lte': now}}]},
+        {'chat_id': 1, 'municipality_code': 1, 'municipality_name': 1, 'metric': 1, 'threshold': 1, 'window': 1},
+      ).sort([('municipality_code', 1), ('metric', 1), ('window', 1), ('threshold', 1)])
+      for alert in cursor:
+        groups = pending_alerts.setdefault(alert['municipality_code'], {})
+        groups.setdefault((alert['metric'], alert['window']), []).append(alert)
+      return pending_alerts
+    return await asyncio.to_thread(query)
+
+  async def mark_notified(self, alerts, now):
+    # Don't notify the alerts again until their window has passed
+    def update():
+      by_window = {}
+      for alert in alerts:
+        by_window.setdefault(alert['window'], []).append(alert['_id'])
+      for window, ids in by_window.items():
+        self.collection.update_many({'_id': {'$in': ids}}, {'$set': {'notified_until': now + timedelta(hours=window)}})
+    await asyncio.to_thread(update)
@@ -0,0 +1,217 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import date, datetime
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+sys.path.insert(0, ROOT_DIR)
+
+# Aemet XML fixtures (A Coruña) and the first day included in them
+DAILY_FIXTURE = os.path.join(FIXTURES_DIR, 'localidad_15030.xml')
+HOURLY_FIXTURE = os.path.join(FIXTURES_DIR, 'localidad_h_15030.xml')
+FIXTURE_DATE = date(2023, 10, 17)
+
+# Municipality names as typed by the users: exact, lowercase, without accents, misspelled...
+QUERIES = [
+  'A Coruña', 'coruña', 'coruna', 'Santiago', 'santiago de compostela', 'Vigo', 'vigo', 'Lugo',
+  'ourense', 'Pontevedra', 'ferrol', 'O Porriño', 'porriño', 'carballo', 'Betanzos', 'Arteixo',
+  'oleiros', 'culleredo', 'Sanxenxo', 'cambados', 'vilagarcia', 'monforte', 'ribadeo', 'Viveiro',
+  'verin', 'xinzo', 'Estrada', 'lalin', 'Ribeira', 'noia', 'muros', 'fisterra', 'xxxx',
+]
+
+# Municipality names checked by `check` and the code they must resolve to (None if not found),
+# searching all of Spain or only Galicia
+RESOLVE_CASES = {
+  'Granada': '18087', 'La Granada': '08094', 'Vitoria': '01059', 'Gasteiz': '01059',
+  'Las Palmas': '35016', 'Santiago': '15078', 'coruna': '15030', 'Estrada': '36017',
+  'Villanueva, Córdoba': '14069', 'xxxx': None,
+}
+GALICIAN_RESOLVE_CASES = {'Vigo': '36057', 'santiago': '15078', 'porriño': '36039', 'Gasteiz': None}
+
+def percentile(values, ratio):
+  values = sorted(values)
+  return values[min(len(values) - 1, int(len(values) * ratio))]
+
+def measure(function, arguments, iterations, warmup):
+  # Run `function` over the arguments cyclically and return the latency and allocation stats
+  for i in range(warmup):
+    function(arguments[i % len(arguments)])
+  latencies = []
+  started_at = time.perf_counter_ns()
+  for i in range(iterations):
+    start = time.perf_counter_ns()
+    function(arguments[i % len(arguments)])
+    latencies.append(time.perf_counter_ns() - start)
+  elapsed = (time.perf_counter_ns() - started_at) / 1e9
+  # Allocations are measured in a separate pass, tracemalloc slows down the code
+  allocations = []
+  tracemalloc.start()
+  for i in range(min(iterations, 200)):
+    tracemalloc.reset_peak()
+    current, _ = tracemalloc.get_traced_memory()
+    function(arguments[i % len(arguments)])
+    allocations.append(tracemalloc.get_traced_memory()[1] - current)
+  tracemalloc.stop()
+  return {
+    'iterations': iterations,
+    'mean_us': statistics.fmean(latencies) / 1e3,
+    'p50_us': percentile(latencies, 0.5) / 1e3,
+    'p90_us': percentile(latencies, 0.9) / 1e3,
+    'p99_us': percentile(latencies, 0.99) / 1e3,
+    'max_us': max(latencies) / 1e3,
+    'ops_per_second': iterations / elapsed,
+    'peak_alloc_bytes': statistics.fmean(allocations),
+  }
+
+def get_benchmarks():
+  # The bot modules are only needed to run the benchmarks, not to compare the results
+  import bot
+  from aemet import Aemet
+  from municipalities import GALICIAN_PROVINCES, get_registry
+  from tools import get_most_similar_municipality_code, municipality_cache
+  registry = get_registry()
+  municipality_cache.clear()
+  with open(DAILY_FIXTURE, 'rb') as file:
+    daily_content = file.read()
+  with open(HOURLY_FIXTURE, 'rb') as file:
+    hourly_content = file.read()
+  daily_forecast = Aemet.parse_forecast('daily', daily_content).days[FIXTURE_DATE]
+  hourly_forecast = Aemet.parse_forecast('hourly', hourly_content).days[FIXTURE_DATE]
+  hours = list(range(24))
+
+  def resolve_cached(query):
+    return get_most_similar_municipality_code(query)
+
+  def end_to_end(query):
+    # Resolve the municipality, parse the hourly forecast and render it
+    registry.search(query)
+    forecast = Aemet.parse_forecast('hourly', hourly_content, [FIXTURE_DATE])
+    return bot.get_hourly_forecast_text(forecast.days[FIXTURE_DATE], FIXTURE_DATE, 12)
+
+  # Name -> (function, arguments)
+  return {
+    'resolve.galicia': (lambda query: registry.search(query, provinces=GALICIAN_PROVINCES), QUERIES),
+    'resolve.spain': (lambda query: registry.search(query), QUERIES),
+    'resolve.cached': (resolve_cached, QUERIES),
+    'parse.daily.all_days': (lambda content: Aemet.parse_forecast('daily', content), [daily_content]),
+    'parse.daily.one_day': (lambda content: Aemet.parse_forecast('daily', content, [FIXTURE_DATE]), [daily_content]),
+    'parse.hourly.all_days': (lambda content: Aemet.parse_forecast('hourly', content), [hourly_content]),
+    'parse.hourly.one_day': (lambda content: Aemet.parse_forecast('hourly', content, [FIXTURE_DATE]), [hourly_content]),
+    'render.daily': (lambda _: bot.get_daily_forecast_text(daily_forecast, FIXTURE_DATE), [None]),
+    'render.hourly': (lambda hour: bot.get_hourly_forecast_text(hourly_forecast, FIXTURE_DATE, hour), hours),
+    'end_to_end.hourly': (end_to_end, QUERIES),
+  }
+
+def run(arguments):
+  results = {}
+  for name, (function, function_arguments) in get_benchmarks().items():
+    if arguments.filter and arguments.filter not in name:
+      continue
+    results[name] = measure(function, function_arguments, arguments.iterations, arguments.warmup)
+    print_result(name, results[name])
+  report = {
+    'created_at': datetime.now().isoformat(timespec='seconds'),
+    'python': platform.python_version(),
+    'platform': platform.platform(),
+    'benchmarks': results,
+  }
+  if arguments.output:
+    with open(arguments.output, 'w') as file:
+      json.dump(report, file, indent=2)
+
+def check(arguments):
+  # Smoke check of the forecast methods used by the handlers: the Aemet cache is seeded with the
+  # fixtures, so they run end to end without requesting Aemet
+  import bot
+  from aemet import Aemet
+  code = '15030'
+  for product, fixture in (('daily', DAILY_FIXTURE), ('hourly', HOURLY_FIXTURE)):
+    with open(fixture, 'rb') as file:
+      Aemet.get_cache().set((product, code), Aemet.parse_forecast(product, file.read()))
+
+  async def run_checks():
+    hourly = await Aemet.get_hourly_forecast(code, FIXTURE_DATE)
+    bot.render_forecast_text('hourly', code, hourly, FIXTURE_DATE, init_hour=12)
+    daily = await Aemet.get_daily_forecast(code, FIXTURE_DATE)
+    bot.render_forecast_text('daily', code, daily, FIXTURE_DATE)
+    weekly = await Aemet.get_forecast_range(code, FIXTURE_DATE, 7)
+    bot.get_weekly_forecast_text(weekly)
+    for language in ('gal', 'es'):
+      bot.render_forecast_text('hourly', code, hourly, FIXTURE_DATE, init_hour=12, language=language)
+    return hourly, daily, weekly
+
+  hourly, daily, weekly = asyncio.run(run_checks())
+  assert hourly.date == FIXTURE_DATE and hourly.location, hourly
+  assert daily.date == FIXTURE_DATE and daily.location, daily
+  assert len(weekly) == 7, weekly
+  print('Forecast methods OK')
+
+  # The cached lookups must not mix names that only differ in the article ('Granada', 'La Granada')
+  from municipalities import GALICIAN_PROVINCES, search_municipalities
+  from tools import get_most_similar_municipality_code, municipality_cache
+  municipality_cache.clear()
+  for query, expected_code in RESOLVE_CASES.items():
+    code, _ = get_most_similar_municipality_code(query)
+    assert code == expected_code, (query, code, expected_code)
+  for query, expected_code in GALICIAN_RESOLVE_CASES.items():
+    municipalities = search_municipalities(query, provinces=GALICIAN_PROVINCES)
+    code = municipalities[0][1] if municipalities else None
+    assert code == expected_code, (query, code, expected_code)
+  print('Municipality lookups OK')
+
+def print_result(name, result):
+  print(
+    f'{name:<24} p50 {result["p50_us"]:>10.1f}us  p90 {result["p90_us"]:>10.1f}us  '
+    f'p99 {result["p99_us"]:>10.1f}us  {result["ops_per_second"]:>10.0f} ops/s  '
+    f'{result["peak_alloc_bytes"]:>10.0f} B/op'
+  )
+
+def compare(arguments):
+  # Compare the p50 latencies of two runs. Exit with an error if any benchmark is slower than allowed.
+  with open(arguments.baseline) as file:
+    baseline = json.load(file)['benchmarks']
+  with open(arguments.current) as file:
+    current = json.load(file)['benchmarks']
+  regressions = []
+  print(f'{"benchmark":<24} {"baseline p50":>14} {"current p50":>14} {"change":>8} {"alloc change":>13}')
+  for name in sorted(set(baseline) & set(current)):
+    before, after = baseline[name], current[name]
+    change = after['p50_us'] / before['p50_us'] - 1
+    alloc_change = after['peak_alloc_bytes'] / before['peak_alloc_bytes'] - 1 if before['peak_alloc_bytes'] else 0
+    print(f'{name:<24} {before["p50_us"]:>12.1f}us {after["p50_us"]:>12.1f}us {change:>+8.1%} {alloc_change:>+13.1%}')
+    if change > arguments.threshold:
+      regressions.append(name)
+  for name in sorted(set(baseline) ^ set(current)):
+    print(f'{name:<24} only in {"baseline" if name in baseline else "current"} run')
+  if regressions:
+    print(f'Regressions above {arguments.threshold:.0%}: {", ".join(regressions)}')
+    sys.exit(1)
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmarks of the municipality lookup, forecast parsing and rendering')
+  subparsers = parser.add_subparsers(dest='command', required=True)
+  run_parser = subparsers.add_parser('run', help='run the benchmarks')
+  run_parser.add_argument('--iterations', type=int, default=1000)
+  run_parser.add_argument('--warmup', type=int, default=50)
+  run_parser.add_argument('--filter', help='only run the benchmarks containing this text')
+  run_parser.add_argument('--output', help='save the results in this JSON file')
+  run_parser.set_defaults(function=run)
+  check_parser = subparsers.add_parser('check', help='run the forecast methods with the fixtures')
+  check_parser.set_defaults(function=check)
+  compare_parser = subparsers.add_parser('compare', help='compare two runs')
+  compare_parser.add_argument('baseline')
+  compare_parser.add_argument('current')
+  compare_parser.add_argument('--threshold', type=float, default=0.1, help='maximum allowed p50 slowdown (0.1 = 10%%)')
+  compare_parser.set_defaults(function=compare)
+  arguments = parser.parse_args()
+  arguments.function(arguments)
+
+if __name__ == '__main__':
+  main()
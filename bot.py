@@ -1,208 +1,623 @@
+import asyncio
+import httpx
 import logging
 import os
-from telegram import Update
-from telegram.ext import CommandHandler, ContextTypes, ApplicationBuilder, MessageHandler
+import pymongo
+import workers
+from telegram import InlineQueryResultArticle, InputTextMessageContent, Update
+from telegram.error import Forbidden, RetryAfter
+from telegram.ext import CommandHandler, ContextTypes, ApplicationBuilder, InlineQueryHandler, MessageHandler
 from ptbcontrib.ptb_jobstores.mongodb import PTBMongoDBJobStore
 from aemet import Aemet
-from datetime import datetime, timedelta
-from tools import get_ranges, get_full_translated_date, get_galician_most_similar_municipality_code
+from localization import DEFAULT_LANGUAGE, LANGUAGES, get_messages, get_sky_state_description
+from alerts import ALERT_UNITS, AlertStore, evaluate_alerts
+from cache import TTLCache
+from metrics import CACHES, start_metrics_server, track
+from municipalities import load_registry, suggest_municipalities
+from datetime import datetime, time, timedelta
+from ratelimit import RateLimiter
+from store import ForecastStore
+from subscriptions import ChatSettingsStore, SubscriptionStore
+from update_processor import ChatOrderedUpdateProcessor
+from tools import get_ranges, get_full_translated_date, get_translated_month, get_translated_weekday, resolve_municipality_code
 
 # Set the Telegram bot token
 TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN')
 DB_URI = os.environ.get('MONGODB_URI')
+# 'polling' or 'webhook'
+BOT_MODE = os.environ.get('BOT_MODE', 'polling')
+# Maximum number of updates processed at the same time. Updates of the same chat are processed in order.
+MAX_CONCURRENT_UPDATES = int(os.environ.get('MAX_CONCURRENT_UPDATES', '32'))
+# Webhook settings. WEBHOOK_URL is the public URL registered in Telegram.
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')
+WEBHOOK_LISTEN = os.environ.get('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.environ.get('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', 'telegram')
+WEBHOOK_SECRET_TOKEN = os.environ.get('WEBHOOK_SECRET_TOKEN')
+# Bot API URL, it can be changed to use a local Bot API server or the stand-in in scripts/fake_telegram.py
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org/bot')
+# Pool running the CPU-bound steps (municipality lookup and forecast parsing): 'thread' or 'process'
+WORKER_POOL = os.environ.get('WORKER_POOL', 'thread')
+WORKER_POOL_SIZE = int(os.environ.get('WORKER_POOL_SIZE', '4'))
+# Maximum number of calls waiting for a free worker before the handlers have to wait
+WORKER_QUEUE_SIZE = int(os.environ.get('WORKER_QUEUE_SIZE', '64'))
+# Directory where the downloaded forecasts are stored, so the cache is warm after a restart.
+# An empty value disables the store.
+FORECAST_STORE_DIR = os.environ.get('FORECAST_STORE_DIR', 'forecasts')
+# Local endpoint with the metrics in Prometheus format, disabled if the port is not set
+METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = os.environ.get('METRICS_PORT')
+
+# Daily report settings
+REPORT_TIME = time(hour=21, minute=0)
+# The forecasts of the subscribed municipalities are downloaded in advance, so at report time
+# they are already in the cache
+PREWARM_ADVANCE = timedelta(minutes=15)
+# Maximum number of municipalities fetched at the same time when sending the report
+REPORT_CONCURRENCY = 10
+# Telegram allows about 30 messages per second to different chats
+REPORT_MESSAGES_PER_SECOND = 25
+
+# Alerts settings. A single job checks every alert subscription periodically.
+ALERTS_CHECK_INTERVAL = timedelta(minutes=30)
+# Words accepted in /alerta for each alert metric
+ALERT_COMMAND_METRICS = {'choiva': 'rain', 'chuvia': 'rain', 'lluvia': 'rain', 'tormenta': 'storm', 'vento': 'wind', 'viento': 'wind'}
+
+# Seconds Telegram can keep the municipality suggestions of an inline query
+INLINE_CACHE_TIME = 86400
+
+# Maximum number of rendered forecast texts kept in memory
+RENDERED_TEXTS_CACHE_SIZE = 2000
 
 logging.basicConfig(
   format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
   level=logging.INFO
 )
 
-def get_hourly_forecast_text(data, date):
+mongo_client = pymongo.MongoClient(DB_URI)
+subscriptions = SubscriptionStore(mongo_client)
+alerts = AlertStore(mongo_client)
+chat_settings = ChatSettingsStore(mongo_client)
+report_semaphore = asyncio.Semaphore(REPORT_CONCURRENCY)
+report_rate_limiter = RateLimiter(REPORT_MESSAGES_PER_SECOND)
+# Rendered forecast texts by (municipality, product, date, start hour, language), with the
+# `elaborado` time of the forecast used to render them
+rendered_texts = TTLCache(max_size=RENDERED_TEXTS_CACHE_SIZE)
+CACHES.register('rendered_texts', lambda: rendered_texts)
+
+def get_hourly_forecast_text(data, date, init_hour=None, language='gal'):
+  messages = get_messages(language)
   # Build the text
-  text = f'Predición para {data["location"]} ({data["province"]}).\n{get_full_translated_date(date)}\n\n'
-  text += f'🌅 Saída do sol: {data["sunrise"]}\n'
-  text += f'🌇 Posta do sol: {data["sunset"]}\n\n'
-  # Time range
-  current_hour = int(datetime.now().strftime('%H'))
-  init_hour = current_hour
-  end_hour = current_hour + 6
+  text = [f'{messages["forecast_title"].format(location=data.location, province=data.province)}\n{get_full_translated_date(date, language)}\n\n']
+  text.append(f'🌅 {messages["sunrise"]}: {data.sunrise}\n')
+  text.append(f'🌇 {messages["sunset"]}: {data.sunset}\n\n')
+  # Time range, from the current hour by default
+  if init_hour is None:
+    init_hour = datetime.now().hour
+  end_hour = init_hour + 6
   # 23 is the last hour of the day
   if end_hour > 23:
     end_hour = 23
-  text += f'🕐 Predición para as {init_hour}h ata as {end_hour}h\n\n'
+  hours = slice(init_hour, end_hour + 1)
+  text.append(f'🕐 {messages["hours_range"].format(start=init_hour, end=end_hour)}\n\n')
   # TEMPERATURE
-  text += '🌡 Temperatura\n'
-  filtered_data = {key: value for key, value in data["temperature"].items() if int(key) >= init_hour and int(key) <= end_hour}
-  text += f'Máxima: {max(filtered_data.values())}ºC\n'
-  text += f'Mínima: {min(filtered_data.values())}ºC\n\n'
+  text.append(f'🌡 {messages["temperature"]}\n')
+  temperatures = [value for value in data.temperature[hours] if value is not None]
+  text.append(f'{messages["maximum"]}: {max(temperatures)}ºC\n')
+  text.append(f'{messages["minimum"]}: {min(temperatures)}ºC\n\n')
   # SKY STATE
-  text += '☁️ Estado do ceo\n'
-  filtered_data = {key: value for key, value in data["sky_state"].items() if int(key) >= init_hour and int(key) <= end_hour}
-  for key, value in filtered_data.items():
-    text += f'Ás {key}h: {Aemet.get_sky_state_description(value["sky_code"])}\n'
+  text.append(f'☁️ {messages["sky_state"]}\n')
+  for hour, sky_code in enumerate(data.sky_state[hours], init_hour):
+    if sky_code is not None:
+      text.append(f'{messages["at_hour"].format(hour=hour)}: {get_sky_state_description(sky_code, language)}\n')
   # RAIN
   will_rain = False
-  text += '\n🌧 Precipitación\n'
-  filtered_data = {key: value for key, value in data["rain"].items() if float(key) >= init_hour and float(key) <= end_hour}
-  if float(max(filtered_data.values())) == 0:
-    text += 'Non se esperan precipitacións\n'
+  text.append(f'\n🌧 {messages["precipitation"]}\n')
+  if max(value or 0 for value in data.rain[hours]) == 0:
+    text.append(f'{messages["no_rain"]}\n')
   else:
     will_rain = True
-    filtered_data = {key: value for key, value in data["rain"].items() if float(value) > 0}
-    rain_ranges = get_ranges([int(key) for key in filtered_data.keys()])
-    text += f'Espérase choiva:\n'
+    rain_ranges = get_ranges([hour for hour, value in enumerate(data.rain) if value])
+    text.append(f'{messages["rain_expected"]}\n')
     for rain_range in rain_ranges:
       if rain_range[0] == rain_range[1]:
-        text += f'\tÁs {rain_range[0]}h\n'
+        text.append(f'\t{messages["at_hour"].format(hour=rain_range[0])}\n')
       else:
-        text += f'\tEntre as {rain_range[0]}h e as {rain_range[1]}h\n'
+        text.append(f'\t{messages["between_hours"].format(start=rain_range[0], end=rain_range[1])}\n')
   # RAIN PROBABILITY
   if will_rain:
-    text += '\n💧 Probabilidade de choiva\n'
-    if '0208' in data["rain_probability"]:
-      text += f'🕐 Madrugada: {data["rain_probability"]["0208"]}%\n'
-    if '0814' in data["rain_probability"]:
-      text += f'🕐 Mañá: {data["rain_probability"]["0814"]}%\n'
-    if '1420' in data["rain_probability"]:
-      text += f'🕐 Tarde: {data["rain_probability"]["1420"]}%\n'
-    if '2002' in data["rain_probability"]:
-      text += f'🕐 Noite: {data["rain_probability"]["2002"]}%\n\n'
+    text.append(f'\n💧 {messages["rain_probability"]}\n')
+    if '0208' in data.rain_probability:
+      text.append(f'🕐 {messages["dawn"]}: {data.rain_probability["0208"]}%\n')
+    if '0814' in data.rain_probability:
+      text.append(f'🕐 {messages["morning"]}: {data.rain_probability["0814"]}%\n')
+    if '1420' in data.rain_probability:
+      text.append(f'🕐 {messages["afternoon"]}: {data.rain_probability["1420"]}%\n')
+    if '2002' in data.rain_probability:
+      text.append(f'🕐 {messages["night"]}: {data.rain_probability["2002"]}%\n\n')
   # STORM
-  filtered_data = data["storm_probability"]
-  if int(max(filtered_data.values())) > 0:
-    text += '⛈ Tormentas:\n'
-    if '0208' in filtered_data and int(filtered_data["0208"]) > 0:
-      text += f'🕐 Madrugada: {filtered_data["0208"]}%\n'
-    if '0814' in filtered_data and int(filtered_data["0814"]) > 0:
-      text += f'🕐 Mañá: {filtered_data["0814"]}%\n'
-    if '1420' in filtered_data and int(filtered_data["1420"]) > 0:
-      text += f'🕐 Tarde: {filtered_data["1420"]}%\n'
-    if '2002' in filtered_data and int(filtered_data["2002"]) > 0:
-      text += f'🕐 Noite: {filtered_data["2002"]}%\n\n'
+  storm_probability = data.storm_probability
+  if max((value or 0 for value in storm_probability.values()), default=0) > 0:
+    text.append(f'⛈ {messages["storms"]}\n')
+    if (storm_probability.get('0208') or 0) > 0:
+      text.append(f'🕐 {messages["dawn"]}: {storm_probability["0208"]}%\n')
+    if (storm_probability.get('0814') or 0) > 0:
+      text.append(f'🕐 {messages["morning"]}: {storm_probability["0814"]}%\n')
+    if (storm_probability.get('1420') or 0) > 0:
+      text.append(f'🕐 {messages["afternoon"]}: {storm_probability["1420"]}%\n')
+    if (storm_probability.get('2002') or 0) > 0:
+      text.append(f'🕐 {messages["night"]}: {storm_probability["2002"]}%\n\n')
   # WIND
-  filtered_data = {key: value for key, value in data["wind"].items() if int(key) >= init_hour and int(key) <= end_hour}
   # Get max speed value
-  max_speed = max([int(value["speed"]) for value in filtered_data.values()])
+  max_speed = max(value or 0 for value in data.wind_speed[hours])
   if max_speed > 10:
-    text += f'🌬 Vento: Refacho máximo de {max_speed} km/h\n'
-  return text
+    text.append(f'🌬 {messages["wind"].format(speed=max_speed)}\n')
+  return ''.join(text)
 
-def get_daily_forecast_text(data, date):
+def get_daily_forecast_text(data, date, language='gal'):
+  messages = get_messages(language)
   # Build the text
-  text = f'Predición para {data["location"]} ({data["province"]}).\n'
-  text += f'{get_full_translated_date(date)}\n\n'
+  text = [f'{messages["forecast_title"].format(location=data.location, province=data.province)}\n']
+  text.append(f'{get_full_translated_date(date, language)}\n\n')
   # TEMPERATURE
-  text += '🌡 Temperatura\n'
-  text += f'Máxima: {data["temperature"]["max"]}ºC (sensación térmica: {data["temperature_sensation"]["max"]}ºC)\n'
-  text += f'Mínima: {data["temperature"]["min"]}ºC (sensación térmica: {data["temperature_sensation"]["min"]}ºC)\n\n'
+  text.append(f'🌡 {messages["temperature"]}\n')
+  text.append(f'{messages["maximum"]}: {data.temperature_max}ºC ({messages["sensation"]}: {data.temperature_sensation_max}ºC)\n')
+  text.append(f'{messages["minimum"]}: {data.temperature_min}ºC ({messages["sensation"]}: {data.temperature_sensation_min}ºC)\n\n')
   # SKY STATE
-  text += '☁️ Estado do ceo\n'
-  text += f'Pola madrugada (de 0 a 6h): {Aemet.get_sky_state_description(data["sky_state"]["00-06"]["sky_code"])}\n'
-  text += f'Pola mañá (de 6 a 12h): {Aemet.get_sky_state_description(data["sky_state"]["06-12"]["sky_code"])}\n'
-  text += f'Pola tarde (de 12 a 18h): {Aemet.get_sky_state_description(data["sky_state"]["12-18"]["sky_code"])}\n'
-  text += f'Pola noite (de 18 a 24h): {Aemet.get_sky_state_description(data["sky_state"]["18-24"]["sky_code"])}\n\n'
+  text.append(f'☁️ {messages["sky_state"]}\n')
+  text.append(f'{messages["during_dawn"]} (de 0 a 6h): {get_sky_state_description(data.sky_state["00-06"], language)}\n')
+  text.append(f'{messages["during_morning"]} (de 6 a 12h): {get_sky_state_description(data.sky_state["06-12"], language)}\n')
+  text.append(f'{messages["during_afternoon"]} (de 12 a 18h): {get_sky_state_description(data.sky_state["12-18"], language)}\n')
+  text.append(f'{messages["during_night"]} (de 18 a 24h): {get_sky_state_description(data.sky_state["18-24"], language)}\n\n')
   # RAIN PROBABILITY
-  filtered_data = {k:v for k, v in dict(data["rain_probability"]).items() if v is not None}
-  will_rain = int(max(filtered_data.values())) > 0
+  will_rain = max(value or 0 for value in data.rain_probability.values()) > 0
   if will_rain:
-    text += '💧 Probabilidade de choiva\n'
-    text += f'Pola mañá: {data["rain_probability"]["06-12"]}%\n'
-    text += f'Pola tarde: {data["rain_probability"]["12-18"]}%\n'
-    text += f'Pola noite: {data["rain_probability"]["18-24"]}%\n\n'
+    text.append(f'💧 {messages["rain_probability"]}\n')
+    text.append(f'{messages["during_morning"]}: {data.rain_probability["06-12"]}%\n')
+    text.append(f'{messages["during_afternoon"]}: {data.rain_probability["12-18"]}%\n')
+    text.append(f'{messages["during_night"]}: {data.rain_probability["18-24"]}%\n\n')
   else:
-    text += 'Non se esperan precipitacións\n\n'
+    text.append(f'{messages["no_rain"]}\n\n')
   # WIND
   # Get max speed value
   # TODO: Get data by time range
-  max_speed = max([int(wind_data["speed"]) for wind_data in data["wind"].values()])
+  max_speed = max(wind.speed or 0 for wind in data.wind.values())
   if max_speed > 10:
-    text += f'🌬 Vento: Refacho máximo de {max_speed} km/h\n'
+    text.append(f'🌬 {messages["wind"].format(speed=max_speed)}\n')
   # SNOW
-  max_snow_quota = {int(v) for v in data["snow_quota"].values() if v is not None}
-  if max_snow_quota and max(max_snow_quota) > 0:
-    text += f'🌨 Cota de neve: {max(max_snow_quota)} m\n'
+  max_snow_quota = max((value for value in data.snow_quota.values() if value is not None), default=0)
+  if max_snow_quota > 0:
+    text.append(f'🌨 {messages["snow_quota"].format(quota=max_snow_quota)}\n')
+  return ''.join(text)
+
+def get_weekly_forecast_text(data, language='gal'):
+  messages = get_messages(language)
+  # Build the text, a line for each day
+  text = [f'{messages["forecast_title"].format(location=data[0].location, province=data[0].province)}\n\n']
+  for day in data:
+    date = messages['short_date'].format(weekday=get_translated_weekday(day.date, language), day=day.date.day, month=get_translated_month(day.date, language))
+    text.append(f'📅 {date}\n')
+    text.append(f'☁️ {get_sky_state_description(day.sky_state.get("00-24"), language)}\n')
+    text.append(f'🌡 {day.temperature_min}ºC / {day.temperature_max}ºC\n')
+    rain_probability = day.rain_probability.get('00-24')
+    if rain_probability:
+      text.append(f'💧 {rain_probability}%\n')
+    text.append('\n')
+  return ''.join(text)
+
+def render_forecast_text(product, municipality_code, data, date, init_hour=None, language='gal'):
+  # Get the text from the cache. It is rendered again if Aemet has updated the forecast.
+  key = (municipality_code, product, data.date, init_hour, language)
+  cached_text = rendered_texts.get(key)
+  if cached_text is not None and cached_text[0] == data.updated_at:
+    return cached_text[1]
+  if product == 'hourly':
+    text = get_hourly_forecast_text(data, date, init_hour, language)
+  else:
+    text = get_daily_forecast_text(data, date, language)
+  rendered_texts.set(key, (data.updated_at, text))
   return text
 
+def get_alert_text(municipality_name, triggered, language='gal'):
+  messages = get_messages(language)
+  # A single message with every alert of a chat triggered in a municipality
+  text = [f'{messages["alert_title"].format(municipality=municipality_name)}\n\n']
+  for alert, value in triggered:
+    description = messages[f'alert_{alert["metric"]}'].capitalize()
+    unit = ALERT_UNITS[alert['metric']]
+    line = messages['alert_line'].format(description=description, value=f'{value:g}', unit=unit, window=alert['window'], threshold=f'{alert["threshold"]:g}')
+    text.append(f'{line}\n')
+  return ''.join(text)
+
+async def get_chat_language(context, chat_id):
+  # The language is read from the database the first time and kept in chat_data
+  language = context.chat_data.get('language')
+  if language is None:
+    language = await chat_settings.get_language(chat_id) or DEFAULT_LANGUAGE
+    context.chat_data['language'] = language
+  return language
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-  await context.bot.send_message(chat_id=update.effective_chat.id, text="¡Ola! Envía /tempo seguido do concello para obter a predición.")
+  messages = get_messages(await get_chat_language(context, update.effective_chat.id))
+  await context.bot.send_message(chat_id=update.effective_chat.id, text=messages['start'])
 
+@track('set_language')
+async def set_language(update: Update, context: ContextTypes.DEFAULT_TYPE):
+  chat_id = update.effective_chat.id
+  if not context.args or context.args[0].lower() not in LANGUAGES:
+    messages = get_messages(await get_chat_language(context, chat_id))
+    await context.bot.send_message(chat_id=chat_id, text=messages['language_usage'])
+    return
+  language = context.args[0].lower()
+  await chat_settings.set_language(chat_id, language)
+  context.chat_data['language'] = language
+  await context.bot.send_message(chat_id=chat_id, text=get_messages(language)['language_configured'])
+
+@track('suggest_municipality')
+async def suggest_municipality(update: Update, context: ContextTypes.DEFAULT_TYPE):
+  # Suggest municipalities while the user types. The chosen one is sent with its code, so the
+  # forecast command doesn't have to search it.
+  suggestions = suggest_municipalities(update.inline_query.query)
+  results = [
+    InlineQueryResultArticle(
+      id=code,
+      title=name,
+      input_message_content=InputTextMessageContent(f'/tempo {name} ({code})'),
+    )
+    for code, name in suggestions
+  ]
+  await update.inline_query.answer(results, cache_time=INLINE_CACHE_TIME)
+
+@track('prediccion')
 async def prediccion(update: Update, context: ContextTypes.DEFAULT_TYPE):
+  language = await get_chat_language(context, update.effective_chat.id)
+  messages = get_messages(language)
   if context.args is None or len(context.args) == 0:
-    await context.bot.send_message(chat_id=update.effective_chat.id, text="Envía /tempo seguido do nome dun concello para obter a predición.")
+    await context.bot.send_message(chat_id=update.effective_chat.id, text=messages['tempo_usage'])
     return
   # Get municipality name and forecast
   municipality_name = ' '.join(context.args)
   # Get ,unicipality code
-  municipality_code, municipality_name = get_galician_most_similar_municipality_code(municipality_name)
+  municipality_code, municipality_name = await resolve_municipality_code(municipality_name)
   if municipality_code is None:
-    await context.bot.send_message(chat_id=update.effective_chat.id, text="Non se atopou o concello.")
+    await context.bot.send_message(chat_id=update.effective_chat.id, text=messages['municipality_not_found'])
     return
   # Get daily forecast from Aemet
   date = datetime.today()
-  data = Aemet.get_hourly_forecast(municipality_code, date)
+  try:
+    data = await Aemet.get_hourly_forecast(municipality_code, date)
+  except httpx.HTTPError:
+    await context.bot.send_message(chat_id=update.effective_chat.id, text=messages['forecast_error'])
+    return
+  if data is None:
+    await context.bot.send_message(chat_id=update.effective_chat.id, text=messages['forecast_error'])
+    return
   # Envía la predicción al chat privado del usuario
-  await context.bot.send_message(chat_id=update.effective_chat.id, text=get_hourly_forecast_text(data, date))
+  text = render_forecast_text('hourly', municipality_code, data, date, init_hour=date.hour, language=language)
+  await context.bot.send_message(chat_id=update.effective_chat.id, text=text)
 
+@track('tomorrow_prediccion')
 async def tomorrow_prediccion(update: Update, context: ContextTypes.DEFAULT_TYPE):
+  language = await get_chat_language(context, update.effective_chat.id)
+  messages = get_messages(language)
   if context.args is None or len(context.args) == 0:
-    await context.bot.send_message(chat_id=update.effective_chat.id, text="Envía /dia seguido do nome dun concello para obter a predición.")
+    await context.bot.send_message(chat_id=update.effective_chat.id, text=messages['mana_usage'])
     return
   # Get municipality name and forecast
   municipality_name = ' '.join(context.args)
   # Get ,unicipality code
-  municipality_code, municipality_name = get_galician_most_similar_municipality_code(municipality_name)
+  municipality_code, municipality_name = await resolve_municipality_code(municipality_name)
   if municipality_code is None:
-    await context.bot.send_message(chat_id=update.effective_chat.id, text="Non se atopou o concello.")
+    await context.bot.send_message(chat_id=update.effective_chat.id, text=messages['municipality_not_found'])
     return
   # Get daily forecast from Aemet
   date = datetime.today() + timedelta(days=1)
-  data = Aemet.get_daily_forecast(municipality_code, date)
+  try:
+    data = await Aemet.get_daily_forecast(municipality_code, date)
+  except httpx.HTTPError:
+    await context.bot.send_message(chat_id=update.effective_chat.id, text=messages['forecast_error'])
+    return
+  if data is None:
+    await context.bot.send_message(chat_id=update.effective_chat.id, text=messages['forecast_error'])
+    return
   # Envía la predicción al chat privado del usuario
-  await context.bot.send_message(chat_id=update.effective_chat.id, text=get_daily_forecast_text(data, date))
+  text = render_forecast_text('daily', municipality_code, data, date, language=language)
+  await context.bot.send_message(chat_id=update.effective_chat.id, text=text)
 
-async def send_daily_report(context: ContextTypes.DEFAULT_TYPE):
-  municipality_code = context.job.data['municipality_code']
-  # Get daily forecast from Aemet
-  date = datetime.today() + timedelta(days=1)
-  data = Aemet.get_daily_forecast(municipality_code, date)
+@track('weekly_prediccion')
+async def weekly_prediccion(update: Update, context: ContextTypes.DEFAULT_TYPE):
+  language = await get_chat_language(context, update.effective_chat.id)
+  messages = get_messages(language)
+  if context.args is None or len(context.args) == 0:
+    await context.bot.send_message(chat_id=update.effective_chat.id, text=messages['semana_usage'])
+    return
+  # Get municipality name and forecast
+  municipality_name = ' '.join(context.args)
+  # Get ,unicipality code
+  municipality_code, municipality_name = await resolve_municipality_code(municipality_name)
+  if municipality_code is None:
+    await context.bot.send_message(chat_id=update.effective_chat.id, text=messages['municipality_not_found'])
+    return
+  # Get the forecast of the next days from Aemet
+  try:
+    data = await Aemet.get_forecast_range(municipality_code, datetime.today(), 7)
+  except httpx.HTTPError:
+    await context.bot.send_message(chat_id=update.effective_chat.id, text=messages['forecast_error'])
+    return
+  if not data:
+    await context.bot.send_message(chat_id=update.effective_chat.id, text=messages['forecast_error'])
+    return
   # Envía la predicción al chat privado del usuario
-  await context.bot.send_message(chat_id=context.job.chat_id, text=get_daily_forecast_text(data, date))
-  # Schedule a new job for tomorroy
-  run_at = date.replace(hour=21, minute=0, second=0, microsecond=0)
-  context.job_queue.run_once(send_daily_report, run_at, data={'municipality_code': municipality_code}, chat_id=context.job.chat_id)
+  await context.bot.send_message(chat_id=update.effective_chat.id, text=get_weekly_forecast_text(data, language))
+
+async def send_report_message(bot, chat_id, text):
+  # Send a report respecting the Telegram limits
+  async with report_rate_limiter:
+    try:
+      await bot.send_message(chat_id=chat_id, text=text)
+    except RetryAfter as error:
+      await asyncio.sleep(error.retry_after)
+      await bot.send_message(chat_id=chat_id, text=text)
+
+async def send_municipality_report(bot, municipality_code, chat_ids, date, languages):
+  # Get daily forecast from Aemet, once for all the subscribers of the municipality
+  async with report_semaphore:
+    try:
+      data = await Aemet.get_daily_forecast(municipality_code, date)
+    except httpx.HTTPError as error:
+      logging.error(f'Could not get the daily report for {municipality_code}: {error!r}')
+      return
+  if data is None:
+    logging.error(f'The daily report for {municipality_code} does not include {date:%Y-%m-%d}')
+    return
+  # The text is rendered once for each language
+  texts = {}
+  for chat_id in chat_ids:
+    language = languages.get(chat_id, DEFAULT_LANGUAGE)
+    if language not in texts:
+      texts[language] = render_forecast_text('daily', municipality_code, data, date, language=language)
+  # Envía la predicción al chat privado de cada usuario
+  results = await asyncio.gather(*[
+    send_report_message(bot, chat_id, texts[languages.get(chat_id, DEFAULT_LANGUAGE)])
+    for chat_id in chat_ids
+  ], return_exceptions=True)
+  for chat_id, result in zip(chat_ids, results):
+    if isinstance(result, Forbidden):
+      # The user blocked the bot
+      await subscriptions.unsubscribe(chat_id)
+    elif isinstance(result, Exception):
+      logging.error(f'Could not send the daily report to {chat_id}: {result!r}')
 
+@track('prewarm_daily_report')
+async def prewarm_daily_report(context: ContextTypes.DEFAULT_TYPE):
+  municipality_codes = await subscriptions.get_municipality_codes()
+  logging.info(f'Prewarming daily report forecasts for {len(municipality_codes)} municipalities')
+  # There may be more subscribed municipalities than forecasts fit in the cache
+  Aemet.reserve_cache(len(municipality_codes))
+  started_at = datetime.now()
+  # Keep the forecasts in the cache until the report has been sent
+  min_ttl = (PREWARM_ADVANCE * 2).total_seconds()
+  completed = 0
+  failed = []
+  async def prefetch(municipality_code):
+    nonlocal completed
+    async with report_semaphore:
+      try:
+        await Aemet.prefetch_forecast('daily', municipality_code, min_ttl)
+      except Exception as error:
+        failed.append(municipality_code)
+        logging.warning(f'Could not prewarm the forecast for {municipality_code}: {error!r}')
+    completed += 1
+    if completed % 100 == 0:
+      logging.info(f'Prewarmed {completed}/{len(municipality_codes)} forecasts')
+  await asyncio.gather(*[prefetch(municipality_code) for municipality_code in municipality_codes])
+  elapsed = (datetime.now() - started_at).total_seconds()
+  logging.info(f'Prewarmed {completed - len(failed)}/{len(municipality_codes)} forecasts in {elapsed:.1f}s ({len(failed)} failed)')
+  if failed:
+    logging.warning(f'Forecasts not prewarmed: {", ".join(failed)}')
+
+@track('send_daily_reports')
+async def send_daily_reports(context: ContextTypes.DEFAULT_TYPE):
+  # Send the report of tomorrow to every subscriber, grouped by municipality
+  date = datetime.today() + timedelta(days=1)
+  subscribers = await subscriptions.get_subscribers_by_municipality()
+  languages = await chat_settings.get_languages()
+  logging.info(f'Sending daily report for {len(subscribers)} municipalities')
+  results = await asyncio.gather(*[
+    send_municipality_report(context.bot, municipality_code, chat_ids, date, languages)
+    for municipality_code, chat_ids in subscribers.items()
+  ], return_exceptions=True)
+  # A failed municipality must not stop the reports of the others
+  for municipality_code, result in zip(subscribers, results):
+    if isinstance(result, Exception):
+      logging.error(f'Could not send the daily report for {municipality_code}: {result!r}')
+
+@track('check_alerts')
+async def check_alerts(context: ContextTypes.DEFAULT_TYPE):
+  # Check every alert not notified recently. The hourly forecast of each municipality is requested
+  # once and evaluated for all its alerts.
+  now = datetime.now()
+  pending_alerts = await alerts.get_pending_alerts(now)
+  logging.info(f'Checking alerts for {len(pending_alerts)} municipalities')
+  # Triggered alerts by (chat, municipality), so a chat gets a single message for each municipality
+  notifications = {}
+  async def evaluate(municipality_code, alert_groups):
+    async with report_semaphore:
+      try:
+        forecast = await Aemet.get_forecast('hourly', municipality_code)
+      except httpx.HTTPError as error:
+        logging.error(f'Could not get the hourly forecast for {municipality_code}: {error!r}')
+        return
+    for alert, value in evaluate_alerts(forecast, alert_groups, now):
+      notifications.setdefault((alert['chat_id'], municipality_code), []).append((alert, value))
+  await asyncio.gather(*[evaluate(municipality_code, alert_groups) for municipality_code, alert_groups in pending_alerts.items()])
+  notified = []
+  languages = await chat_settings.get_languages() if notifications else {}
+  async def notify(chat_id, triggered):
+    text = get_alert_text(triggered[0][0]['municipality_name'], triggered, languages.get(chat_id, DEFAULT_LANGUAGE))
+    try:
+      await send_report_message(context.bot, chat_id, text)
+    except Forbidden:
+      # The user blocked the bot
+      await alerts.remove(chat_id)
+      return
+    except Exception as error:
+      logging.error(f'Could not send the alert to {chat_id}: {error!r}')
+      return
+    notified.extend(alert for alert, _ in triggered)
+  await asyncio.gather(*[notify(chat_id, triggered) for (chat_id, _), triggered in notifications.items()])
+  if notified:
+    await alerts.mark_notified(notified, now)
+  logging.info(f'Sent {len(notifications)} alert messages')
+
+@track('schedule_alert')
+async def schedule_alert(update: Update, context: ContextTypes.DEFAULT_TYPE):
+  chat_id = update.effective_chat.id
+  messages = get_messages(await get_chat_language(context, chat_id))
+  usage = messages['alert_usage']
+  if context.args is None or len(context.args) < 3 or context.args[0].lower() not in ALERT_COMMAND_METRICS:
+    await context.bot.send_message(chat_id=chat_id, text=usage)
+    return
+  metric = ALERT_COMMAND_METRICS[context.args[0].lower()]
+  try:
+    threshold = float(context.args[1].replace(',', '.'))
+  except ValueError:
+    await context.bot.send_message(chat_id=chat_id, text=usage)
+    return
+  municipality_code, municipality_name = await resolve_municipality_code(' '.join(context.args[2:]))
+  if municipality_code is None:
+    await context.bot.send_message(chat_id=chat_id, text=messages['municipality_not_found'])
+    return
+  # Save the alert, it is checked by the alerts job
+  await alerts.add(chat_id, municipality_code, municipality_name, metric, threshold)
+  text = messages['alert_configured'].format(municipality=municipality_name, description=messages[f'alert_{metric}'], threshold=f'{threshold:g}', unit=ALERT_UNITS[metric])
+  await context.bot.send_message(chat_id=chat_id, text=text)
+
+@track('remove_alerts')
+async def remove_alerts(update: Update, context: ContextTypes.DEFAULT_TYPE):
+  messages = get_messages(await get_chat_language(context, update.effective_chat.id))
+  await alerts.remove(update.effective_chat.id)
+  await context.bot.send_message(chat_id=update.effective_chat.id, text=messages['alerts_removed'])
+
+@track('schedule_report')
 async def schedule_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
   chat_id = update.message.chat_id
+  messages = get_messages(await get_chat_language(context, chat_id))
   # Get the municipality code
   municipality_name = ' '.join(context.args)
   # Get ,unicipality code
-  municipality_code, municipality_name = get_galician_most_similar_municipality_code(municipality_name)
+  municipality_code, municipality_name = await resolve_municipality_code(municipality_name)
   # If it doesn't exist, send an error message
   if municipality_code is None:
-    await context.bot.send_message(chat_id=update.effective_chat.id, text="Non se atopou o concello.")
+    await context.bot.send_message(chat_id=update.effective_chat.id, text=messages['municipality_not_found'])
     return
-  # Schedule the job with the municipality code
-  today = datetime.now()
-  run_at = today.replace(hour=21, minute=0, second=0, microsecond=0)
-  context.job_queue.run_once(send_daily_report, run_at, data={'municipality_code': municipality_code}, chat_id=chat_id)
-  await context.bot.send_message(chat_id=chat_id, text=f'Envío de reporte diario configurado para {municipality_name}')
+  # Save the subscription, the report is sent by the daily report job
+  await subscriptions.subscribe(chat_id, municipality_code, municipality_name)
+  await context.bot.send_message(chat_id=chat_id, text=messages['report_configured'].format(municipality=municipality_name))
+
+async def send_daily_report(context: ContextTypes.DEFAULT_TYPE):
+  # Before the batch report, each subscription was a one-off job calling this function, which
+  # scheduled the next one. The stored jobs still point to it: move the subscription to the
+  # subscriptions collection instead of sending the report (the batch job sends it). The job is
+  # not scheduled again.
+  if context.job.data and 'municipality_code' in context.job.data:
+    await subscriptions.subscribe(context.job.chat_id, context.job.data['municipality_code'])
+
+@track('migrate_legacy_report_jobs')
+async def migrate_legacy_report_jobs(context: ContextTypes.DEFAULT_TYPE):
+  migrated = 0
+  for job in context.job_queue.jobs():
+    if job.callback is send_daily_report and job.data and 'municipality_code' in job.data:
+      await subscriptions.subscribe(job.chat_id, job.data['municipality_code'])
+      job.schedule_removal()
+      migrated += 1
+  if migrated:
+    logging.info(f'Migrated {migrated} legacy daily report jobs to subscriptions')
+
+async def post_init(application):
+  await subscriptions.setup()
+  await alerts.setup()
+  # The workers of a process pool load their own municipalities registry
+  workers.configure(WORKER_POOL, WORKER_POOL_SIZE, WORKER_QUEUE_SIZE, initializer=load_registry if WORKER_POOL == 'process' else None)
+  if METRICS_PORT:
+    application.bot_data['metrics_server'] = await start_metrics_server(METRICS_HOST, int(METRICS_PORT))
+  # The scheduler doesn't read the job stores until it is started, so the legacy report jobs are
+  # migrated by a job that runs once the application has started
+  application.job_queue.run_once(migrate_legacy_report_jobs, 0, name='migrate_legacy_report_jobs')
+
+async def post_shutdown(application):
+  # Close the connections pool used to request Aemet
+  await Aemet.close()
+  workers.shutdown()
+  metrics_server = application.bot_data.get('metrics_server')
+  if metrics_server is not None:
+    metrics_server.close()
+    await metrics_server.wait_closed()
 
 def main():
+    # Load the municipalities registry before receiving any command
+    load_registry()
+    # The stored forecasts are loaded when they are requested for the first time
+    if FORECAST_STORE_DIR:
+      Aemet.set_store(ForecastStore(FORECAST_STORE_DIR))
     # Create the bot
-    application = ApplicationBuilder().token(TOKEN).build()
+    application = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .base_url(TELEGRAM_API_URL)
+        .concurrent_updates(ChatOrderedUpdateProcessor(MAX_CONCURRENT_UPDATES))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     # Commands
     application.add_handler(CommandHandler('start', start))
     application.add_handler(CommandHandler('tempo', prediccion))
     application.add_handler(CommandHandler('mana', tomorrow_prediccion))
+    application.add_handler(CommandHandler('semana', weekly_prediccion))
     application.add_handler(CommandHandler('reporte', schedule_report))
+    application.add_handler(CommandHandler('alerta', schedule_alert))
+    application.add_handler(CommandHandler('borraralertas', remove_alerts))
+    application.add_handler(CommandHandler('lingua', set_language))
+    application.add_handler(InlineQueryHandler(suggest_municipality))
     # Jobs manager
     application.job_queue.scheduler.add_jobstore(
         PTBMongoDBJobStore(
             application=application,
-            host=DB_URI,
+            client=mongo_client,
         )
     )
+    # A single job sends the daily report to every subscriber
+    application.job_queue.run_daily(
+        send_daily_reports,
+        REPORT_TIME,
+        name='daily_report',
+        job_kwargs={'id': 'daily_report', 'replace_existing': True},
+    )
+    application.job_queue.run_daily(
+        prewarm_daily_report,
+        (datetime.combine(datetime.today(), REPORT_TIME) - PREWARM_ADVANCE).time(),
+        name='prewarm_daily_report',
+        job_kwargs={'id': 'prewarm_daily_report', 'replace_existing': True},
+    )
+    # A single job checks the alerts of every subscriber
+    application.job_queue.run_repeating(
+        check_alerts,
+        ALERTS_CHECK_INTERVAL,
+        name='check_alerts',
+        job_kwargs={'id': 'check_alerts', 'replace_existing': True},
+    )
     # Run the bot
-    application.run_polling()
+    if BOT_MODE == 'webhook':
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET_TOKEN,
+        )
+    else:
+        application.run_polling()
 
 if __name__ == '__main__':
     main()
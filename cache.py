@@ -0,0 +1,82 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+class TTLCache:
+  # In-memory cache with a maximum size (least recently used entries are evicted first)
+  # and an expiration time for each entry. A `ttl` of None means that entries never expire.
+  def __init__(self, max_size=1000, ttl=None):
+    self.max_size = max_size
+    self.ttl = ttl
+    self.hits = 0
+    self.misses = 0
+    # Key -> (value, expiration timestamp)
+    self.__entries = OrderedDict()
+    # Key -> task fetching the value, used to coalesce concurrent misses
+    self.__pending = {}
+
+  def __len__(self):
+    return len(self.__entries)
+
+  def __contains__(self, key):
+    return self.__lookup(key) is not None
+
+  def get(self, key, default=None):
+    entry = self.__lookup(key)
+    if entry is None:
+      self.misses += 1
+      return default
+    self.hits += 1
+    return entry[0]
+
+  def set(self, key, value, ttl=None):
+    ttl = self.ttl if ttl is None else ttl
+    expires_at = None if ttl is None else time.monotonic() + ttl
+    self.__entries[key] = (value, expires_at)
+    self.__entries.move_to_end(key)
+    # Evict the least recently used entries
+    while len(self.__entries) > self.max_size:
+      self.__entries.popitem(last=False)
+
+  def invalidate(self, key):
+    self.__entries.pop(key, None)
+
+  def clear(self):
+    self.__entries.clear()
+
+  def hit_ratio(self):
+    total = self.hits + self.misses
+    return self.hits / total if total else 0.0
+
+  async def get_or_fetch(self, key, fetch):
+    # `fetch` is a coroutine function returning a (value, ttl) tuple. Only one fetch per key
+    # runs at the same time: concurrent misses for the same key wait for the same result.
+    entry = self.__lookup(key)
+    if entry is not None:
+      self.hits += 1
+      return entry[0]
+    self.misses += 1
+    task = self.__pending.get(key)
+    if task is None:
+      task = asyncio.ensure_future(self.__fetch(key, fetch))
+      self.__pending[key] = task
+    # Shield the shared task, so a cancelled caller doesn't cancel the fetch for the rest
+    return await asyncio.shield(task)
+
+  async def __fetch(self, key, fetch):
+    try:
+      value, ttl = await fetch()
+      self.set(key, value, ttl)
+      return value
+    finally:
+      self.__pending.pop(key, None)
+
+  def __lookup(self, key):
+    entry = self.__entries.get(key)
+    if entry is None:
+      return None
+    if entry[1] is not None and entry[1] <= time.monotonic():
+      del self.__entries[key]
+      return None
+    self.__entries.move_to_end(key)
+    return entry
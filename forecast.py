@@ -0,0 +1,73 @@
+from dataclasses import dataclass, field
+from datetime import date
+
+HOURS_PER_DAY = 24
+
+def parse_int(value):
+  if value is None or value.strip() == '':
+    return None
+  return int(value)
+
+def parse_float(value):
+  if value is None or value.strip() == '':
+    return None
+  # 'Ip' (inapreciable) is used for rain amounts too small to be measured
+  if value.strip() == 'Ip':
+    return 0.0
+  return float(value)
+
+def hourly_series():
+  # One slot for each hour of the day, None when there is no forecast for that hour
+  return [None] * HOURS_PER_DAY
+
+@dataclass(slots=True)
+class Wind:
+  direction: str = None
+  speed: int = None
+
+@dataclass(slots=True)
+class DailyForecast:
+  date: date
+  location: str = None
+  province: str = None
+  updated_at: str = None
+  # Values by period ('00-24', '00-12', '12-24', '00-06', '06-12', '12-18' and '18-24')
+  sky_state: dict = field(default_factory=dict)
+  rain_probability: dict = field(default_factory=dict)
+  wind: dict = field(default_factory=dict)
+  snow_quota: dict = field(default_factory=dict)
+  # Max and min temperatures, and temperatures by hour (6, 12, 18 and 24)
+  temperature_max: int = None
+  temperature_min: int = None
+  temperature: dict = field(default_factory=dict)
+  temperature_sensation_max: int = None
+  temperature_sensation_min: int = None
+  temperature_sensation: dict = field(default_factory=dict)
+
+@dataclass(slots=True)
+class HourlyForecast:
+  date: date
+  location: str = None
+  province: str = None
+  updated_at: str = None
+  sunrise: str = None
+  sunset: str = None
+  # Values by hour of the day
+  sky_state: list = field(default_factory=hourly_series)
+  rain: list = field(default_factory=hourly_series)
+  temperature: list = field(default_factory=hourly_series)
+  temperature_sensation: list = field(default_factory=hourly_series)
+  wind_direction: list = field(default_factory=hourly_series)
+  wind_speed: list = field(default_factory=hourly_series)
+  wind_gust: list = field(default_factory=hourly_series)
+  # Values by period ('0208', '0814', '1420' and '2002')
+  rain_probability: dict = field(default_factory=dict)
+  storm_probability: dict = field(default_factory=dict)
+
+@dataclass(slots=True)
+class Forecast:
+  # Forecast of all the days included in an Aemet XML
+  location: str = None
+  province: str = None
+  updated_at: str = None
+  days: dict = field(default_factory=dict)
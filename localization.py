@@ -0,0 +1,185 @@
+# Texts of the bot in Galician (gal) and Spanish (es). Every table is built when the module is
+# imported, so translating a text while rendering a message is a dict or list lookup.
+
+LANGUAGES = ('gal', 'es')
+DEFAULT_LANGUAGE = 'gal'
+
+# Description in Spanish (es) and Galician (gal) for each Aemet icon code.
+# If the code contains a 'n' at the end, it means that it is night. Night description are not included in this JSON.
+# The night description is the same as the day description, but with a 'noche' at the end. Example: 'Despejado' -> 'Despejado noche'
+# Source: https://www.aemet.es/es/eltiempo/prediccion/espana/ayuda
+SKY_STATE_CODES_DESCRIPTION = {
+  11: {'es': 'Despejado', 'gal': 'Despexado'},
+  12: {'es': 'Poco nuboso', 'gal': 'Pouco nubrado'},
+  13: {'es': 'Intervalos nubosos', 'gal': 'Intervalos nubrados'},
+  14: {'es': 'Nuboso', 'gal': 'Nubrado'},
+  15: {'es': 'Muy nuboso', 'gal': 'Moi nubrado'},
+  16: {'es': 'Cubierto', 'gal': 'Cuberto'},
+  17: {'es': 'Nubes altas', 'gal': 'Nubes altas'},
+  23: {'es': 'Intervalos nubosos con lluvia', 'gal': 'Intervalos nubrados con choiva'},
+  24: {'es': 'Nuboso con lluvia', 'gal': 'Nubrado con choiva'},
+  25: {'es': 'Muy nuboso con lluvia', 'gal': 'Moi nubrado con choiva'},
+  26: {'es': 'Cubierto con lluvia', 'gal': 'Cuberto con choiva'},
+  33: {'es': 'Intervalos nubosos con nieve', 'gal': 'Intervalos nubrados con neve'},
+  34: {'es': 'Nuboso con nieve', 'gal': 'Nubrado con neve'},
+  35: {'es': 'Muy nuboso con nieve', 'gal': 'Moi nubrado con neve'},
+  36: {'es': 'Cubierto con nieve', 'gal': 'Cuberto con neve'},
+  43: {'es': 'Intervalos nubosos con lluvia escasa', 'gal': 'Intervalos nubrados con choiva escasa'},
+  44: {'es': 'Nuboso con lluvia escasa', 'gal': 'Nubrado con choiva escasa'},
+  45: {'es': 'Muy nuboso con lluvia escasa', 'gal': 'Moi nubrado con choiva escasa'},
+  46: {'es': 'Cubierto con lluvia escasa', 'gal': 'Cuberto con choiva escasa'},
+  51: {'es': 'Intervalos nubosos con tormenta', 'gal': 'Intervalos nubrados con tormenta'},
+  52: {'es': 'Nuboso con tormenta', 'gal': 'Nubrado con tormenta'},
+  53: {'es': 'Muy nuboso con tormenta', 'gal': 'Moi nubrado con tormenta'},
+  54: {'es': 'Cubierto con tormenta', 'gal': 'Cuberto con tormenta'},
+  61: {'es': 'Intervalos nubosos con tormenta y lluvia escasa', 'gal': 'Intervalos nubrados con tormenta e choiva escasa'},
+  62: {'es': 'Nuboso con tormenta y lluvia escasa', 'gal': 'Nubrado con tormenta e choiva escasa'},
+  63: {'es': 'Muy nuboso con tormenta y lluvia escasa', 'gal': 'Moi nubrado con tormenta e choiva escasa'},
+  64: {'es': 'Cubierto con tormenta y lluvia escasa', 'gal': 'Cuberto con tormenta e choiva escasa'},
+  71: {'es': 'Intervalos nubosos con nieve escasa', 'gal': 'Intervalos nubrados con neve escasa'},
+  72: {'es': 'Nuboso con nieve escasa', 'gal': 'Nubrado con neve escasa'},
+  73: {'es': 'Muy nuboso con nieve escasa', 'gal': 'Moi nubrado con neve escasa'},
+  74: {'es': 'Cubierto con nieve escasa', 'gal': 'Cuberto con neve escasa'},
+  81: {'es': 'Niebla', 'gal': 'Néboa'},
+  82: {'es': 'Bruma', 'gal': 'Brétema'},
+  83: {'es': 'Calima', 'gal': ''},
+}
+
+def build_sky_states():
+  # Description by language and code as it is written in the XML. The night codes ('11n') use
+  # the description of the day code.
+  sky_states = {language: {} for language in LANGUAGES}
+  for code, descriptions in SKY_STATE_CODES_DESCRIPTION.items():
+    for language in LANGUAGES:
+      sky_states[language][str(code)] = descriptions[language]
+      sky_states[language][f'{code}n'] = descriptions[language]
+  return sky_states
+
+SKY_STATES = build_sky_states()
+
+# Abbreviated month names, from January
+MONTHS = {
+  'gal': ['Xan', 'Feb', 'Mar', 'Abr', 'Mai', 'Xun', 'Xul', 'Ago', 'Set', 'Out', 'Nov', 'Dec'],
+  'es': ['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun', 'Jul', 'Ago', 'Sep', 'Oct', 'Nov', 'Dic'],
+}
+
+# Weekday names, from Monday
+WEEKDAYS = {
+  'gal': ['Luns', 'Martes', 'Mércores', 'Xoves', 'Venres', 'Sábado', 'Domingo'],
+  'es': ['Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo'],
+}
+
+MESSAGES = {
+  'gal': {
+    'start': '¡Ola! Envía /tempo seguido do concello para obter a predición.',
+    'tempo_usage': 'Envía /tempo seguido do nome dun concello para obter a predición.',
+    'mana_usage': 'Envía /mana seguido do nome dun concello para obter a predición.',
+    'semana_usage': 'Envía /semana seguido do nome dun concello para obter a predición.',
+    'municipality_not_found': 'Non se atopou o concello.',
+    'forecast_error': 'Non se puido obter a predición. Inténtao de novo máis tarde.',
+    'report_configured': 'Envío de reporte diario configurado para {municipality}',
+    'alert_usage': 'Envía /alerta seguido de choiva (mm), tormenta (%) ou vento (km/h), o límite e o concello. Por exemplo: /alerta choiva 5 Vigo',
+    'alert_configured': 'Aviso configurado para {municipality}: {description} por riba de {threshold} {unit}',
+    'alerts_removed': 'Elimináronse os teus avisos.',
+    'alert_title': '⚠️ Aviso para {municipality}',
+    'alert_line': '{description}: ata {value} {unit} nas próximas {window} horas (límite {threshold} {unit})',
+    'alert_rain': 'choiva',
+    'alert_storm': 'probabilidade de tormenta',
+    'alert_wind': 'refachos de vento',
+    'language_usage': 'Envía /lingua gal para galego ou /lingua es para castelán.',
+    'language_configured': 'As mensaxes enviaranse en galego.',
+    'forecast_title': 'Predición para {location} ({province}).',
+    'full_date': '{weekday}, {day} de {month} de {year}',
+    'short_date': '{weekday}, {day} de {month}',
+    'sunrise': 'Saída do sol',
+    'sunset': 'Posta do sol',
+    'hours_range': 'Predición para as {start}h ata as {end}h',
+    'temperature': 'Temperatura',
+    'maximum': 'Máxima',
+    'minimum': 'Mínima',
+    'sensation': 'sensación térmica',
+    'sky_state': 'Estado do ceo',
+    'at_hour': 'Ás {hour}h',
+    'between_hours': 'Entre as {start}h e as {end}h',
+    'precipitation': 'Precipitación',
+    'no_rain': 'Non se esperan precipitacións',
+    'rain_expected': 'Espérase choiva:',
+    'rain_probability': 'Probabilidade de choiva',
+    'storms': 'Tormentas:',
+    'dawn': 'Madrugada',
+    'morning': 'Mañá',
+    'afternoon': 'Tarde',
+    'night': 'Noite',
+    'during_dawn': 'Pola madrugada',
+    'during_morning': 'Pola mañá',
+    'during_afternoon': 'Pola tarde',
+    'during_night': 'Pola noite',
+    'wind': 'Vento: Refacho máximo de {speed} km/h',
+    'snow_quota': 'Cota de neve: {quota} m',
+  },
+  'es': {
+    'start': '¡Hola! Envía /tempo seguido del municipio para obtener la predicción.',
+    'tempo_usage': 'Envía /tempo seguido del nombre de un municipio para obtener la predicción.',
+    'mana_usage': 'Envía /mana seguido del nombre de un municipio para obtener la predicción.',
+    'semana_usage': 'Envía /semana seguido del nombre de un municipio para obtener la predicción.',
+    'municipality_not_found': 'No se encontró el municipio.',
+    'forecast_error': 'No se pudo obtener la predicción. Inténtalo de nuevo más tarde.',
+    'report_configured': 'Envío de informe diario configurado para {municipality}',
+    'alert_usage': 'Envía /alerta seguido de lluvia (mm), tormenta (%) o viento (km/h), el límite y el municipio. Por ejemplo: /alerta lluvia 5 Vigo',
+    'alert_configured': 'Aviso configurado para {municipality}: {description} por encima de {threshold} {unit}',
+    'alerts_removed': 'Se eliminaron tus avisos.',
+    'alert_title': '⚠️ Aviso para {municipality}',
+    'alert_line': '{description}: hasta {value} {unit} en las próximas {window} horas (límite {threshold} {unit})',
+    'alert_rain': 'lluvia',
+    'alert_storm': 'probabilidad de tormenta',
+    'alert_wind': 'rachas de viento',
+    'language_usage': 'Envía /lingua gal para gallego o /lingua es para castellano.',
+    'language_configured': 'Los mensajes se enviarán en castellano.',
+    'forecast_title': 'Predicción para {location} ({province}).',
+    'full_date': '{weekday}, {day} de {month} de {year}',
+    'short_date': '{weekday}, {day} de {month}',
+    'sunrise': 'Salida del sol',
+    'sunset': 'Puesta del sol',
+    'hours_range': 'Predicción de las {start}h a las {end}h',
+    'temperature': 'Temperatura',
+    'maximum': 'Máxima',
+    'minimum': 'Mínima',
+    'sensation': 'sensación térmica',
+    'sky_state': 'Estado del cielo',
+    'at_hour': 'A las {hour}h',
+    'between_hours': 'Entre las {start}h y las {end}h',
+    'precipitation': 'Precipitación',
+    'no_rain': 'No se esperan precipitaciones',
+    'rain_expected': 'Se espera lluvia:',
+    'rain_probability': 'Probabilidad de lluvia',
+    'storms': 'Tormentas:',
+    'dawn': 'Madrugada',
+    'morning': 'Mañana',
+    'afternoon': 'Tarde',
+    'night': 'Noche',
+    'during_dawn': 'Por la madrugada',
+    'during_morning': 'Por la mañana',
+    'during_afternoon': 'Por la tarde',
+    'during_night': 'Por la noche',
+    'wind': 'Viento: Racha máxima de {speed} km/h',
+    'snow_quota': 'Cota de nieve: {quota} m',
+  },
+}
+
+def get_language(language):
+  # Unknown languages use the default one
+  return language if language in MESSAGES else DEFAULT_LANGUAGE
+
+def get_messages(language=DEFAULT_LANGUAGE):
+  return MESSAGES[get_language(language)]
+
+def get_sky_state_description(code, language=DEFAULT_LANGUAGE):
+  if code is None:
+    return ''
+  return SKY_STATES[get_language(language)].get(code, '')
+
+def get_month(date, language=DEFAULT_LANGUAGE):
+  return MONTHS[get_language(language)][date.month - 1]
+
+def get_weekday(date, language=DEFAULT_LANGUAGE):
+  return WEEKDAYS[get_language(language)][date.weekday()]
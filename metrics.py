@@ -0,0 +1,238 @@
+import asyncio
+import functools
+import logging
+import sys
+import threading
+import time
+from collections import Counter as StackCounter
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Default histogram buckets, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def format_labels(names, values, extra=()):
+  labels = [f'{name}="{value}"' for name, value in (*zip(names, values), *extra)]
+  return '{' + ','.join(labels) + '}' if labels else ''
+
+class Metric:
+  type = None
+
+  def __init__(self, name, description, labels=()):
+    self.name = name
+    self.description = description
+    self.labels = tuple(labels)
+    # Label values -> value
+    self.values = {}
+    REGISTRY.append(self)
+
+  def collect(self):
+    lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.type}']
+    for label_values, value in sorted(self.values.items()):
+      lines.append(f'{self.name}{format_labels(self.labels, label_values)} {value}')
+    return lines
+
+class Counter(Metric):
+  type = 'counter'
+
+  def inc(self, *label_values, amount=1):
+    self.values[label_values] = self.values.get(label_values, 0) + amount
+
+class Gauge(Metric):
+  type = 'gauge'
+
+  def inc(self, *label_values, amount=1):
+    self.values[label_values] = self.values.get(label_values, 0) + amount
+
+  def dec(self, *label_values, amount=1):
+    self.inc(*label_values, amount=-amount)
+
+  def set(self, *label_values, value):
+    self.values[label_values] = value
+
+class Histogram(Metric):
+  type = 'histogram'
+
+  def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+    super().__init__(name, description, labels)
+    self.buckets = tuple(buckets)
+
+  def observe(self, *label_values, value):
+    # Label values -> [count by bucket..., sum, count]
+    counts = self.values.get(label_values)
+    if counts is None:
+      counts = self.values[label_values] = [0] * (len(self.buckets) + 2)
+    for i, bucket in enumerate(self.buckets):
+      if value <= bucket:
+        counts[i] += 1
+    counts[-2] += value
+    counts[-1] += 1
+
+  def time(self, *label_values):
+    return Timer(self, label_values)
+
+  def collect(self):
+    lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.type}']
+    for label_values, counts in sorted(self.values.items()):
+      for bucket, count in zip(self.buckets, counts):
+        lines.append(f'{self.name}_bucket{format_labels(self.labels, label_values, [("le", bucket)])} {count}')
+      lines.append(f'{self.name}_bucket{format_labels(self.labels, label_values, [("le", "+Inf")])} {counts[-1]}')
+      lines.append(f'{self.name}_sum{format_labels(self.labels, label_values)} {counts[-2]}')
+      lines.append(f'{self.name}_count{format_labels(self.labels, label_values)} {counts[-1]}')
+    return lines
+
+class Timer:
+  # Context manager observing the elapsed time in a histogram
+  def __init__(self, histogram, label_values):
+    self.histogram = histogram
+    self.label_values = label_values
+
+  def __enter__(self):
+    self.started_at = time.perf_counter()
+    return self
+
+  def __exit__(self, *args):
+    self.histogram.observe(*self.label_values, value=time.perf_counter() - self.started_at)
+    return False
+
+class CacheMetrics:
+  # Hits, misses, hit ratio and size of the registered caches, read when the metrics are collected
+  def __init__(self):
+    self.caches = {}
+    REGISTRY.append(self)
+
+  def register(self, name, get_cache):
+    # `get_cache` returns the cache, so caches created lazily can be registered
+    self.caches[name] = get_cache
+
+  def collect(self):
+    caches = {name: get_cache() for name, get_cache in sorted(self.caches.items())}
+    lines = []
+    for metric, metric_type, description, get_value in (
+      ('otempo_cache_hits_total', 'counter', 'Cache hits', lambda cache: cache.hits),
+      ('otempo_cache_misses_total', 'counter', 'Cache misses', lambda cache: cache.misses),
+      ('otempo_cache_hit_ratio', 'gauge', 'Ratio of cache hits', lambda cache: cache.hit_ratio()),
+      ('otempo_cache_size', 'gauge', 'Number of entries in the cache', len),
+    ):
+      lines += [f'# HELP {metric} {description}', f'# TYPE {metric} {metric_type}']
+      for name, cache in caches.items():
+        lines.append(f'{metric}{{cache="{name}"}} {get_value(cache)}')
+    return lines
+
+REGISTRY = []
+
+HANDLER_DURATION = Histogram('otempo_handler_duration_seconds', 'Time spent in the bot handlers and jobs', ['handler'])
+HANDLER_IN_FLIGHT = Gauge('otempo_handler_in_flight', 'Handlers and jobs running', ['handler'])
+HANDLER_ERRORS = Counter('otempo_handler_errors_total', 'Handlers and jobs finished with an exception', ['handler'])
+CACHES = CacheMetrics()
+
+def track(name):
+  # Decorator recording the duration, the in-flight count and the errors of a coroutine function
+  def decorator(function):
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+      HANDLER_IN_FLIGHT.inc(name)
+      try:
+        with HANDLER_DURATION.time(name):
+          return await function(*args, **kwargs)
+      except Exception:
+        HANDLER_ERRORS.inc(name)
+        raise
+      finally:
+        HANDLER_IN_FLIGHT.dec(name)
+    return wrapper
+  return decorator
+
+def render_metrics():
+  lines = []
+  for metric in REGISTRY:
+    lines += metric.collect()
+  return '\n'.join(lines) + '\n'
+
+class SamplingProfiler:
+  # Samples the stack of a thread periodically and counts the collapsed stacks
+  # ('file:function;file:function count'), which can be converted to a flame graph.
+  def __init__(self):
+    self.samples = StackCounter()
+    self.interval = None
+    self.__thread = None
+    self.__stop = threading.Event()
+
+  @property
+  def running(self):
+    return self.__thread is not None and self.__thread.is_alive()
+
+  def start(self, interval=0.005, thread_id=None):
+    if self.running:
+      return
+    self.interval = interval
+    self.samples.clear()
+    self.__stop.clear()
+    target = thread_id if thread_id is not None else threading.get_ident()
+    self.__thread = threading.Thread(target=self.__sample, args=(target,), name='sampling-profiler', daemon=True)
+    self.__thread.start()
+
+  def stop(self):
+    if self.running:
+      self.__stop.set()
+      self.__thread.join()
+
+  def report(self, limit=200):
+    return '\n'.join(f'{stack} {count}' for stack, count in self.samples.most_common(limit)) + '\n'
+
+  def __sample(self, thread_id):
+    while not self.__stop.wait(self.interval):
+      frame = sys._current_frames().get(thread_id)
+      stack = []
+      while frame is not None:
+        stack.append(f'{frame.f_code.co_filename.rsplit("/", 1)[-1]}:{frame.f_code.co_name}')
+        frame = frame.f_back
+      if stack:
+        self.samples[';'.join(reversed(stack))] += 1
+
+profiler = SamplingProfiler()
+
+async def handle_request(reader, writer):
+  # Minimal HTTP server with the metrics and the profiler controls:
+  #   GET /metrics                            Prometheus text format
+  #   GET /profiler/start?interval=0.005      start sampling the event loop thread
+  #   GET /profiler/stop                      stop sampling
+  #   GET /profiler                           collapsed stacks sampled so far
+  try:
+    request_line = await reader.readline()
+    # Skip the headers
+    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+      pass
+    parts = request_line.decode('latin-1').split()
+    url = urlsplit(parts[1] if len(parts) > 1 else '/')
+    query = parse_qs(url.query)
+    status = '200 OK'
+    if url.path == '/metrics':
+      body = render_metrics()
+    elif url.path == '/profiler/start':
+      profiler.start(float(query.get('interval', ['0.005'])[0]))
+      body = f'Profiler running, sampling every {profiler.interval}s\n'
+    elif url.path == '/profiler/stop':
+      profiler.stop()
+      body = 'Profiler stopped\n'
+    elif url.path == '/profiler':
+      body = profiler.report(int(query.get('limit', ['200'])[0]))
+    else:
+      status = '404 Not Found'
+      body = 'Not found\n'
+    content = body.encode('utf-8')
+    writer.write(
+      f'HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+      f'Content-Length: {len(content)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + content
+    )
+    await writer.drain()
+  except Exception as error:
+    logger.warning(f'Error serving metrics request: {error!r}')
+  finally:
+    writer.close()
+
+async def start_metrics_server(host='127.0.0.1', port=9100):
+  server = await asyncio.start_server(handle_request, host, port)
+  logger.info(f'Metrics available at http://{host}:{port}/metrics')
+  return server
@@ -0,0 +1,298 @@
+import bisect
+import csv
+import heapq
+import os
+import re
+import unicodedata
+import jellyfish
+from array import array
+from collections import Counter
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# Articles ignored when comparing names, so 'A Coruña' and 'Coruña, A' are the same municipality.
+# Spanish, Galician and Catalan articles are included.
+ARTICLES = {'el', 'la', 'los', 'las', 'o', 'a', 'os', 'as', 'l', 'els', 'les', 'es', 'sa', 'ses'}
+
+# Size of the n-grams used to select the candidates before computing the similarity
+NGRAM_SIZE = 3
+# Minimum ratio of query n-grams that a name must contain to be scored
+MIN_SHARED_NGRAMS_RATIO = 0.3
+# Minimum similarity of the names containing the whole query as whole words, at the beginning
+# ('santiago' -> 'Santiago de Compostela') or after other words ('gasteiz' -> 'Vitoria-Gasteiz')
+WORD_MATCH_SIMILARITY = 0.95
+# Limits that keep the cost of a lookup flat as the number of municipalities grows. The n-grams
+# of the query are used from the rarest one, until MAX_COUNTED_POSITIONS names are counted (the
+# MIN_QUERY_NGRAMS rarest n-grams are always used), so common n-grams (' de') are skipped. Then
+# only the MAX_CANDIDATES names sharing more n-grams with the query are scored.
+MAX_COUNTED_POSITIONS = 600
+MIN_QUERY_NGRAMS = 3
+MAX_CANDIDATES = 30
+# Maximum number of suggestions returned for a prefix
+MAX_SUGGESTIONS = 10
+
+# INE province codes (CPRO) and their names, including the names in the co-official languages
+PROVINCES = {
+  '01': ('Araba', 'Álava'), '02': ('Albacete',), '03': ('Alacant', 'Alicante'), '04': ('Almería',),
+  '05': ('Ávila',), '06': ('Badajoz',), '07': ('Illes Balears', 'Baleares'), '08': ('Barcelona',),
+  '09': ('Burgos',), '10': ('Cáceres',), '11': ('Cádiz',), '12': ('Castelló', 'Castellón'),
+  '13': ('Ciudad Real',), '14': ('Córdoba',), '15': ('A Coruña', 'La Coruña'), '16': ('Cuenca',),
+  '17': ('Girona', 'Gerona'), '18': ('Granada',), '19': ('Guadalajara',), '20': ('Gipuzkoa', 'Guipúzcoa'),
+  '21': ('Huelva',), '22': ('Huesca',), '23': ('Jaén',), '24': ('León',), '25': ('Lleida', 'Lérida'),
+  '26': ('La Rioja',), '27': ('Lugo',), '28': ('Madrid',), '29': ('Málaga',), '30': ('Murcia',),
+  '31': ('Navarra', 'Nafarroa'), '32': ('Ourense', 'Orense'), '33': ('Asturias',), '34': ('Palencia',),
+  '35': ('Las Palmas', 'Gran Canaria'), '36': ('Pontevedra',), '37': ('Salamanca',),
+  '38': ('Santa Cruz de Tenerife', 'Tenerife'), '39': ('Cantabria',), '40': ('Segovia',), '41': ('Sevilla',),
+  '42': ('Soria',), '43': ('Tarragona',), '44': ('Teruel',), '45': ('Toledo',), '46': ('València', 'Valencia'),
+  '47': ('Valladolid',), '48': ('Bizkaia', 'Vizcaya'), '49': ('Zamora',), '50': ('Zaragoza',),
+  '51': ('Ceuta',), '52': ('Melilla',),
+}
+GALICIAN_PROVINCES = ('15', '27', '32', '36')
+
+def fold_name(name):
+  # Remove accents, punctuation and case, keeping the articles ('Coruña, A' -> 'a coruna')
+  name = unicodedata.normalize('NFKD', name)
+  name = ''.join(c for c in name if not unicodedata.combining(c)).lower()
+  words = re.sub(r"[^a-z0-9,]+", ' ', name).split()
+  # Move the trailing article ('Coruña, A') to the beginning
+  if len(words) > 1 and words[-2].endswith(','):
+    words = [words[-1]] + words[:-1]
+  words = [word.strip(',') for word in words]
+  return ' '.join(word for word in words if word)
+
+def remove_article(folded_name):
+  words = folded_name.split(' ')
+  if len(words) > 1 and words[0] in ARTICLES:
+    return ' '.join(words[1:])
+  return folded_name
+
+def normalize_name(name):
+  # Same as fold_name, without the leading article
+  return remove_article(fold_name(name))
+
+def get_ngrams(name):
+  padded = f'{" " * (NGRAM_SIZE - 1)}{name} '
+  return {padded[i:i + NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1)}
+
+# Normalized province name -> province code
+PROVINCE_CODES = {normalize_name(name): code for code, names in PROVINCES.items() for name in names}
+# Province hint at the end of a query: 'Villanueva, Córdoba' or 'Villanueva (Córdoba)'
+PROVINCE_HINT = re.compile(r'^(.+?)\s*(?:,|\()\s*([^,()]+?)\s*\)?\s*$')
+
+class MunicipalityRegistry:
+  # Every municipality of Spain, loaded once. The municipalities and their names (aliases) are
+  # kept sorted by code in compact arrays, so the aliases of each province (the first two digits
+  # of the code) are a contiguous range of positions. The inverted index of n-grams maps each
+  # n-gram to a sorted array of alias positions: restricting a search to a province is a binary
+  # search in each array, and only the names sharing more n-grams with the query are scored.
+  def __init__(self, municipalities, preferred_provinces=()):
+    # `municipalities` is a list of (code, name, aliases) tuples
+    self.codes = array('I')
+    self.names = []
+    self.positions = {}
+    self.alias_names = []
+    # Alias names with their article, to tell 'Granada' from 'Granada, La'
+    self.alias_folded_names = []
+    self.alias_municipalities = array('H')
+    self.province_ranges = {}
+    self.ngrams = {}
+    self.preferred_provinces = set(preferred_provinces)
+    for code, name, aliases in sorted(municipalities):
+      municipality = len(self.names)
+      self.codes.append(int(code))
+      self.names.append(name)
+      self.positions[code] = municipality
+      normalized_names = []
+      for alias in aliases:
+        folded_name = fold_name(alias)
+        normalized_name = remove_article(folded_name)
+        if not normalized_name or normalized_name in normalized_names:
+          continue
+        normalized_names.append(normalized_name)
+        position = len(self.alias_names)
+        self.alias_names.append(normalized_name)
+        self.alias_folded_names.append(folded_name)
+        self.alias_municipalities.append(municipality)
+        start, _ = self.province_ranges.get(code[:2], (position, position))
+        self.province_ranges[code[:2]] = (start, position + 1)
+        for ngram in get_ngrams(normalized_name):
+          self.ngrams.setdefault(ngram, array('H')).append(position)
+    # Index to suggest municipalities while the user types
+    preferred_codes = {code for code in self.positions if code[:2] in self.preferred_provinces}
+    self.prefixes = PrefixIndex(zip(self.positions, self.names), preferred=preferred_codes)
+
+  def __len__(self):
+    return len(self.names)
+
+  def get_code(self, municipality):
+    return f'{self.codes[municipality]:05d}'
+
+  def get_name(self, code):
+    position = self.positions.get(code)
+    return None if position is None else self.names[position]
+
+  def search(self, query, limit=1, threshold=0.8, provinces=None):
+    # Return a list of (similarity, code, name) tuples of the most similar municipalities. A
+    # province at the end of the query ('Villanueva, Córdoba') limits the search to it.
+    query, province = split_province_hint(query)
+    if province is not None:
+      provinces = (province,)
+    folded_query = fold_name(query)
+    query = remove_article(folded_query)
+    if not query:
+      return []
+    query_ngrams = get_ngrams(query)
+    postings = [self.ngrams[ngram] for ngram in query_ngrams if ngram in self.ngrams]
+    if provinces is not None:
+      # Keep the positions of the provinces, merged in a single posting for each n-gram
+      ranges = [self.province_ranges[province] for province in provinces if province in self.province_ranges]
+      province_postings = []
+      for posting in postings:
+        province_posting = array('H')
+        for start, end in ranges:
+          province_posting.extend(posting[bisect.bisect_left(posting, start):bisect.bisect_left(posting, end)])
+        if province_posting:
+          province_postings.append(province_posting)
+      postings = province_postings
+    # Count the names sharing the rarest n-grams with the query
+    postings.sort(key=len)
+    selected = []
+    counted = 0
+    for posting in postings:
+      if len(selected) >= MIN_QUERY_NGRAMS and counted + len(posting) > MAX_COUNTED_POSITIONS:
+        break
+      selected.append(posting)
+      counted += len(posting)
+    shared = Counter()
+    for posting in selected:
+      shared.update(posting)
+    # Score the names sharing more n-grams with the query
+    min_shared = max(1, int(len(selected) * MIN_SHARED_NGRAMS_RATIO))
+    candidates = [position for position, count in shared.items() if count >= min_shared]
+    if len(candidates) > MAX_CANDIDATES:
+      candidates = sorted(candidates, key=shared.__getitem__, reverse=True)[:MAX_CANDIDATES]
+    # The names are ranked by exact match with the article, exact match without it, whole words
+    # match (at the beginning of the name first) and similarity
+    best = {}
+    padded_query = f' {query} '
+    for position in candidates:
+      normalized_name = self.alias_names[position]
+      similarity = jellyfish.jaro_winkler_similarity(query, normalized_name)
+      word_match = 0
+      if normalized_name.startswith(padded_query[1:]):
+        word_match = 2
+      elif padded_query in f' {normalized_name} ':
+        word_match = 1
+      if word_match:
+        similarity = max(similarity, WORD_MATCH_SIMILARITY)
+      if similarity <= threshold:
+        continue
+      rank = (self.alias_folded_names[position] == folded_query, normalized_name == query, word_match, similarity)
+      municipality = self.alias_municipalities[position]
+      if municipality not in best or rank > best[municipality]:
+        best[municipality] = rank
+    # On the same rank, the municipalities of the preferred provinces go first
+    results = heapq.nlargest(limit, best.items(), key=lambda item: (item[1], self.get_code(item[0])[:2] in self.preferred_provinces, -item[0]))
+    return [(rank[-1], self.get_code(municipality), self.names[municipality]) for municipality, rank in results]
+
+class PrefixIndex:
+  # Sorted lists of normalized names to suggest municipalities while the user types. The names
+  # starting with a prefix are contiguous, so they are found with a binary search. Besides the
+  # whole names, the words inside them are indexed too ('compostela' -> 'Santiago de Compostela').
+  # The preferred municipalities are suggested before the rest.
+  def __init__(self, municipalities, preferred=()):
+    self.names = {}
+    # Keys of the preferred names, the rest of names, the preferred words and the rest of words
+    tiers = [[], [], [], []]
+    for code, name in municipalities:
+      self.names[code] = name
+      tier = 0 if code in preferred else 1
+      for alias in name.split('/'):
+        words = normalize_name(alias).split()
+        if not words:
+          continue
+        tiers[tier].append((' '.join(words), code))
+        for position in range(1, len(words)):
+          tiers[tier + 2].append((' '.join(words[position:]), code))
+    self.tiers = []
+    for keys in tiers:
+      keys.sort()
+      self.tiers.append(([key for key, _ in keys], [code for _, code in keys]))
+
+  def __len__(self):
+    return len(self.names)
+
+  def search(self, prefix, limit=MAX_SUGGESTIONS):
+    # Return a list of (code, name) tuples, the names starting with the prefix first
+    prefix = normalize_name(prefix)
+    if not prefix:
+      return []
+    codes = []
+    for keys, key_codes in self.tiers:
+      for position in range(bisect.bisect_left(keys, prefix), len(keys)):
+        if len(codes) == limit or not keys[position].startswith(prefix):
+          break
+        if key_codes[position] not in codes:
+          codes.append(key_codes[position])
+    return [(code, self.names[code]) for code in codes]
+
+def read_galician_municipalities(filename=os.path.join(DATA_DIR, 'meteogalicia_municipalities.csv')):
+  # CSV was downloaded from INE website: https://www.ine.es/daco/daco42/codmun/codmunmapa.htm
+  with open(filename, newline='', encoding='utf-8') as csvfile:
+    reader = csv.reader(csvfile, delimiter=';')
+    # Skip the header
+    next(reader)
+    return [(row[0], row[1]) for row in reader]
+
+def read_spain_municipalities(filename=os.path.join(DATA_DIR, 'municipalities_codes.csv')):
+  # CSV was downloaded from INE website: https://www.ine.es/daco/daco42/codmun/codmunmapa.htm
+  with open(filename, newline='', encoding='utf-8') as csvfile:
+    reader = csv.reader(csvfile, delimiter=';')
+    # Skip the header
+    next(reader)
+    return [(f'{row[1]}{row[2]}', row[4]) for row in reader]
+
+def read_municipalities():
+  # Every Spanish municipality with its names. Galician municipalities are shown with their
+  # Galician name ('A Coruña' instead of 'Coruña, A'), both names can be searched.
+  galician_names = dict(read_galician_municipalities())
+  municipalities = []
+  for code, name in read_spain_municipalities():
+    aliases = name.split('/')
+    if code in galician_names:
+      name = galician_names[code]
+      aliases = [name] + aliases
+    municipalities.append((code, name, aliases))
+  return municipalities
+
+def split_province_hint(query):
+  # Return the query without the province hint and the province code, or None if there isn't one
+  if ',' not in query and '(' not in query:
+    return query, None
+  match = PROVINCE_HINT.match(query)
+  if match is not None:
+    province = PROVINCE_CODES.get(normalize_name(match.group(2)))
+    if province is not None:
+      return match.group(1), province
+  return query, None
+
+# Registry built the first time it is used or when `load_registry` is called
+_registry = None
+
+def get_registry():
+  global _registry
+  if _registry is None:
+    _registry = MunicipalityRegistry(read_municipalities(), preferred_provinces=GALICIAN_PROVINCES)
+  return _registry
+
+def load_registry():
+  get_registry()
+
+def search_municipalities(query, limit=1, threshold=0.8, provinces=None):
+  return get_registry().search(query, limit=limit, threshold=threshold, provinces=provinces)
+
+def suggest_municipalities(prefix, limit=MAX_SUGGESTIONS):
+  return get_registry().prefixes.search(prefix, limit=limit)
+
+def get_municipality_name(code):
+  return get_registry().get_name(code)
@@ -0,0 +1,24 @@
+import asyncio
+
+class RateLimiter:
+  # Allow at most `rate` calls per second, spacing them evenly
+  def __init__(self, rate):
+    self.interval = 1 / rate
+    self.__next_call = 0
+    self.__lock = asyncio.Lock()
+
+  async def acquire(self):
+    async with self.__lock:
+      loop = asyncio.get_running_loop()
+      now = loop.time()
+      if self.__next_call > now:
+        await asyncio.sleep(self.__next_call - now)
+        now = self.__next_call
+      self.__next_call = now + self.interval
+
+  async def __aenter__(self):
+    await self.acquire()
+    return self
+
+  async def __aexit__(self, *args):
+    return False
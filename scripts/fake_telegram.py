@@ -0,0 +1,106 @@
+import argparse
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import httpx
+
+# Local stand-in of the Telegram Bot API to test the webhook mode. It answers the Bot API
+# methods used by the bot, records the sent messages and posts updates to the bot webhook.
+#
+# Start the bot pointing to the stand-in:
+#   TELEGRAM_BOT_TOKEN=123:fake TELEGRAM_API_URL=http://127.0.0.1:8081/bot BOT_MODE=webhook \
+#   WEBHOOK_URL=http://127.0.0.1:8443/telegram WEBHOOK_LISTEN=127.0.0.1 python bot.py
+# And post the updates:
+#   python scripts/fake_telegram.py --updates 200 --chats 20 --text "/tempo vigo"
+
+sent_messages = []
+sent_messages_lock = threading.Lock()
+
+class BotApiHandler(BaseHTTPRequestHandler):
+  def do_POST(self):
+    # Paths are /bot<token>/<method>
+    method = self.path.rsplit('/', 1)[-1]
+    body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+    if self.headers.get('Content-Type', '').startswith('application/json'):
+      parameters = json.loads(body or b'{}')
+    else:
+      parameters = {key: values[0] for key, values in parse_qs(body.decode('utf-8')).items()}
+    result = True
+    if method == 'getMe':
+      result = {'id': 123, 'is_bot': True, 'first_name': 'O Tempo', 'username': 'otempo_bot', 'can_join_groups': True, 'can_read_all_group_messages': False, 'supports_inline_queries': True}
+    elif method == 'sendMessage':
+      with sent_messages_lock:
+        sent_messages.append((time.perf_counter(), int(parameters['chat_id']), parameters.get('text', '')))
+        message_id = len(sent_messages)
+      result = {'message_id': message_id, 'date': int(time.time()), 'chat': {'id': int(parameters['chat_id']), 'type': 'private'}, 'text': parameters.get('text', '')}
+    content = json.dumps({'ok': True, 'result': result}).encode('utf-8')
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(content)))
+    self.end_headers()
+    self.wfile.write(content)
+
+  def log_message(self, format, *args):
+    pass
+
+def build_update(update_id, chat_id, text):
+  return {
+    'update_id': update_id,
+    'message': {
+      'message_id': update_id,
+      'date': int(time.time()),
+      'chat': {'id': chat_id, 'type': 'private', 'first_name': f'User {chat_id}'},
+      'from': {'id': chat_id, 'is_bot': False, 'first_name': f'User {chat_id}'},
+      'text': text,
+      'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}] if text.startswith('/') else [],
+    },
+  }
+
+async def post_updates(arguments):
+  headers = {}
+  if arguments.secret_token:
+    headers['X-Telegram-Bot-Api-Secret-Token'] = arguments.secret_token
+  async with httpx.AsyncClient(timeout=30) as client:
+    async def post_chat_updates(chat):
+      # Like Telegram, the updates of a chat are posted one after another and the chats in parallel
+      for update_id in range(chat + 1, arguments.updates + 1, arguments.chats):
+        update = build_update(update_id, 1000 + chat, arguments.text)
+        response = await client.post(arguments.webhook, json=update, headers=headers)
+        response.raise_for_status()
+    started_at = time.perf_counter()
+    await asyncio.gather(*[post_chat_updates(chat) for chat in range(arguments.chats)])
+    return started_at
+
+def main():
+  parser = argparse.ArgumentParser(description='Local stand-in of the Telegram Bot API which posts updates to the bot webhook')
+  parser.add_argument('--api-host', default='127.0.0.1')
+  parser.add_argument('--api-port', type=int, default=8081)
+  parser.add_argument('--webhook', default='http://127.0.0.1:8443/telegram', help='bot webhook URL')
+  parser.add_argument('--secret-token', help='value of WEBHOOK_SECRET_TOKEN')
+  parser.add_argument('--updates', type=int, default=100, help='number of updates to post')
+  parser.add_argument('--chats', type=int, default=10, help='number of different chats sending the updates')
+  parser.add_argument('--text', default='/tempo A Coruña', help='text of the messages')
+  parser.add_argument('--wait', type=float, default=5, help='seconds to wait for the bot to be ready before posting')
+  parser.add_argument('--timeout', type=float, default=60, help='seconds to wait for the answers')
+  arguments = parser.parse_args()
+
+  server = ThreadingHTTPServer((arguments.api_host, arguments.api_port), BotApiHandler)
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  print(f'Bot API stand-in listening on http://{arguments.api_host}:{arguments.api_port}/bot')
+  time.sleep(arguments.wait)
+
+  started_at = asyncio.run(post_updates(arguments))
+  print(f'Posted {arguments.updates} updates from {arguments.chats} chats')
+  # Wait for an answer to every update
+  deadline = time.perf_counter() + arguments.timeout
+  while len(sent_messages) < arguments.updates and time.perf_counter() < deadline:
+    time.sleep(0.05)
+  elapsed = (sent_messages[-1][0] if sent_messages else time.perf_counter()) - started_at
+  print(f'Received {len(sent_messages)} messages in {elapsed:.2f}s ({len(sent_messages) / elapsed:.1f} messages/s)')
+  server.shutdown()
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,102 @@
+import gzip
+import logging
+import os
+import pickle
+import tempfile
+from dataclasses import dataclass
+from forecast import Forecast
+
+logger = logging.getLogger(__name__)
+
+# Increase it when the forecast classes change, so old snapshots are parsed again from the XML
+SNAPSHOT_VERSION = 2
+
+@dataclass(slots=True)
+class StoredForecast:
+  forecast: Forecast
+  # HTTP validators of the downloaded XML, to revalidate it with a conditional request
+  etag: str = None
+  last_modified: str = None
+  # Timestamp (time.time) of the last download or revalidation
+  fetched_at: float = 0
+
+class ForecastStore:
+  # Downloaded forecasts on disk, so the bot doesn't start with an empty cache after a restart.
+  # For each product and municipality it keeps the compressed Aemet XML and a snapshot of the
+  # parsed forecast with the HTTP validators. The methods do blocking IO, run them in a thread.
+  def __init__(self, directory):
+    self.directory = directory
+
+  def load(self, product, municipality):
+    # The forecast is None if the snapshot was written with other SNAPSHOT_VERSION: it must be
+    # parsed again from the stored XML (load_xml), the HTTP validators are still valid
+    try:
+      with open(self.__path(product, municipality, 'pickle'), 'rb') as file:
+        snapshot = pickle.load(file)
+    except FileNotFoundError:
+      return None
+    except Exception as error:
+      logger.warning(f'Could not load the stored {product} forecast of {municipality}: {error!r}')
+      return None
+    # Snapshots written before the validators were stored apart from the forecast
+    if not isinstance(snapshot, dict):
+      return None
+    stored_forecast = StoredForecast(
+      forecast=None,
+      etag=snapshot['etag'],
+      last_modified=snapshot['last_modified'],
+      fetched_at=snapshot['fetched_at'],
+    )
+    if snapshot['version'] == SNAPSHOT_VERSION:
+      try:
+        stored_forecast.forecast = pickle.loads(snapshot['forecast'])
+      except Exception as error:
+        logger.warning(f'Could not load the stored {product} forecast of {municipality}: {error!r}')
+    return stored_forecast
+
+  def load_xml(self, product, municipality):
+    try:
+      with gzip.open(self.__path(product, municipality, 'xml.gz'), 'rb') as file:
+        return file.read()
+    except FileNotFoundError:
+      return None
+    except Exception as error:
+      logger.warning(f'Could not load the stored {product} XML of {municipality}: {error!r}')
+      return None
+
+  def save(self, product, municipality, stored_forecast, content=None):
+    # The raw XML is only written when it has changed (`content` is None after a revalidation).
+    # The store is only a cache: errors are logged, they never fail the forecast request.
+    try:
+      self.__save(product, municipality, stored_forecast, content)
+    except Exception as error:
+      logger.warning(f'Could not store the {product} forecast of {municipality}: {error!r}')
+
+  def __save(self, product, municipality, stored_forecast, content):
+    os.makedirs(os.path.join(self.directory, product), exist_ok=True)
+    if content is not None:
+      self.__write(self.__path(product, municipality, 'xml.gz'), gzip.compress(content))
+    # The forecast is pickled apart, so the validators can be read even if the forecast classes change
+    snapshot = {
+      'version': SNAPSHOT_VERSION,
+      'etag': stored_forecast.etag,
+      'last_modified': stored_forecast.last_modified,
+      'fetched_at': stored_forecast.fetched_at,
+      'forecast': pickle.dumps(stored_forecast.forecast),
+    }
+    self.__write(self.__path(product, municipality, 'pickle'), pickle.dumps(snapshot))
+
+  def __path(self, product, municipality, extension):
+    return os.path.join(self.directory, product, f'{municipality}.{extension}')
+
+  def __write(self, path, data):
+    # Write to a temporary file first, so a crash never leaves a file half written. Each write has
+    # its own temporary file, so concurrent saves of the same forecast don't overwrite each other.
+    file = tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix=os.path.basename(path), suffix='.tmp', delete=False)
+    try:
+      with file:
+        file.write(data)
+      os.replace(file.name, path)
+    except BaseException:
+      os.unlink(file.name)
+      raise
@@ -0,0 +1,58 @@
+import asyncio
+import pymongo
+
+class SubscriptionStore:
+  # Daily report subscriptions, stored in MongoDB next to the jobs of the bot.
+  # pymongo is synchronous, so the queries run in a thread to avoid blocking the event loop.
+  def __init__(self, client, database='apscheduler', collection='subscriptions'):
+    self.collection = client[database][collection]
+
+  async def setup(self):
+    def create_indexes():
+      self.collection.create_index([('chat_id', pymongo.ASCENDING), ('municipality_code', pymongo.ASCENDING)], unique=True)
+      self.collection.create_index('municipality_code')
+    await asyncio.to_thread(create_indexes)
+
+  async def subscribe(self, chat_id, municipality_code, municipality_name=None):
+    await asyncio.to_thread(
+      self.collection.update_one,
+      {'chat_id': chat_id, 'municipality_code': municipality_code},
+      {'$set': {'municipality_name': municipality_name}},
+      upsert=True,
+    )
+
+  async def unsubscribe(self, chat_id, municipality_code=None):
+    query = {'chat_id': chat_id}
+    if municipality_code is not None:
+      query['municipality_code'] = municipality_code
+    await asyncio.to_thread(self.collection.delete_many, query)
+
+  async def get_subscribers_by_municipality(self):
+    # Return a dict with the chat ids subscribed to each municipality code
+    def query():
+      subscribers = {}
+      for subscription in self.collection.find({}, {'_id': 0, 'chat_id': 1, 'municipality_code': 1}):
+        subscribers.setdefault(subscription['municipality_code'], []).append(subscription['chat_id'])
+      return subscribers
+    return await asyncio.to_thread(query)
+
+  async def get_municipality_codes(self):
+    return await asyncio.to_thread(self.collection.distinct, 'municipality_code')
+
+class ChatSettingsStore:
+  # Settings of each chat (the language of the messages), by chat id
+  def __init__(self, client, database='apscheduler', collection='chats'):
+    self.collection = client[database][collection]
+
+  async def get_language(self, chat_id):
+    settings = await asyncio.to_thread(self.collection.find_one, {'_id': chat_id}, {'language': 1})
+    return settings.get('language') if settings else None
+
+  async def set_language(self, chat_id, language):
+    await asyncio.to_thread(self.collection.update_one, {'_id': chat_id}, {'$set': {'language': language}}, upsert=True)
+
+  async def get_languages(self):
+    # Return a dict with the language of every chat which has set one
+    def query():
+      return {settings['_id']: settings['language'] for settings in self.collection.find({'language': {'$exists': True}}, {'language': 1})}
+    return await asyncio.to_thread(query)
@@ -1,5 +1,19 @@
-import jellyfish
-import csv
+import re
+from cache import TTLCache
+from localization import get_messages, get_month, get_weekday
+from metrics import CACHES, Histogram
+from workers import run_cpu_timed, timed_call
+from municipalities import fold_name, get_municipality_name, search_municipalities, split_province_hint
+
+# Resolved (code, name) of the last queried municipality names, including the ones not found.
+# Keys are the folded name and the province hint, so 'Coruña' and 'coruna' share the same entry.
+municipality_cache = TTLCache(max_size=8192)
+CACHES.register('municipalities', lambda: municipality_cache)
+
+# Municipality chosen in the inline suggestions, sent as 'Name (code)'
+MUNICIPALITY_WITH_CODE = re.compile(r'^(.*)\((\d{5})\)\s*$')
+
+LOOKUP_DURATION = Histogram('otempo_municipality_lookup_duration_seconds', 'Time spent looking up municipality names', ['scope'])
 
 def get_ranges(lst):
   ranges = []
@@ -13,91 +27,66 @@ def get_ranges(lst):
   ranges.append((start, end))
   return ranges
 
-def get_translated_month(date):
-  month = date.strftime('%b')
-  if month == 'Jan':
-    return 'Xan'
-  elif month == 'Feb':
-    return 'Feb'
-  elif month == 'Mar':
-    return 'Mar'
-  elif month == 'Apr':
-    return 'Abr'
-  elif month == 'May':
-    return 'Mai'
-  elif month == 'Jun':
-    return 'Xun'
-  elif month == 'Jul':
-    return 'Xul'
-  elif month == 'Aug':
-    return 'Ago'
-  elif month == 'Sep':
-    return 'Set'
-  elif month == 'Oct':
-    return 'Out'
-  elif month == 'Nov':
-    return 'Nov'
-  elif month == 'Dec':
-    return 'Dec'
-  else:
-    return month
+def get_translated_month(date, language='gal'):
+  return get_month(date, language)
 
-def get_translated_weekday(date):
-  weekday = date.weekday()
-  if weekday == 0:
-    return 'Luns'
-  elif weekday == 1:
-    return 'Martes'
-  elif weekday == 2:
-    return 'Mércores'
-  elif weekday == 3:
-    return 'Xoves'
-  elif weekday == 4:
-    return 'Venres'
-  elif weekday == 5:
-    return 'Sábado'
-  elif weekday == 6:
-    return 'Domingo'
-  else:
-    return weekday
+def get_translated_weekday(date, language='gal'):
+  return get_weekday(date, language)
 
-def get_full_translated_date(date):
-  return f'{get_translated_weekday(date)}, {date.day} de {get_translated_month(date)} de {date.year}'
+def get_full_translated_date(date, language='gal'):
+  return get_messages(language)['full_date'].format(
+    weekday=get_weekday(date, language), day=date.day, month=get_month(date, language), year=date.year,
+  )
 
-def get_galician_most_similar_municipality_code(municipality_name):
-  # Get municipalities from CSV file. CSV was downloaded from INE website:
-  # https://www.ine.es/daco/daco42/codmun/codmunmapa.htm
-  filename = 'data/meteogalicia_municipalities.csv'
-  municipalities = []
-  with open(filename, newline='') as csvfile:
-    reader = csv.reader(csvfile, delimiter=';')
-    for row in reader:
-      # If municipality name is similar to the one provided, add it to the list
-      if jellyfish.jaro_winkler_similarity(municipality_name, row[1]) > 0.8:
-        municipalities.append(row)
-  # Get the most similar municipality
-  municipality_data = sorted(municipalities, key=lambda x: jellyfish.jaro_winkler_similarity(municipality_name, x[1]), reverse=True)
-  if len(municipality_data) > 0:
-    municipality_data = municipality_data[0]
-    return (municipality_data[0], municipality_data[1])
+def find_municipality(municipality_name, province=None):
+  provinces = None if province is None else (province,)
+  municipalities = search_municipalities(municipality_name, threshold=0.8, provinces=provinces)
+  if len(municipalities) > 0:
+    _, code, name = municipalities[0]
+    return (code, name)
   else:
     return (None, None)
 
-def get_spain_most_similar_municipality_code(municipality_name):
-  # Get municipalities from CSV file. CSV was downloaded from INE website:
-  # https://www.ine.es/daco/daco42/codmun/codmunmapa.htm
-  filename = 'data/municipalities_codes.csv'
-  municipalities = []
-  with open(filename, newline='') as csvfile:
-    reader = csv.reader(csvfile, delimiter=';')
-    for row in reader:
-      # If municipality name is similar to the one provided, add it to the list
-      if jellyfish.jaro_winkler_similarity(municipality_name, row[4]) > 0.9:
-        municipalities.append(row)
-  # Get the most similar municipality
-  municipality_data = sorted(municipalities, key=lambda x: jellyfish.jaro_winkler_similarity(municipality_name, x[4]), reverse=True)
-  if len(municipality_data) > 0:
-    municipality_data = municipality_data[0]
-    return (f'{municipality_data[1]}{municipality_data[2]}', municipality_data[4])
-  else:
-    return (None, None)
+def get_municipality_with_code(text):
+  # Return (code, name) if the text carries a known municipality code, so it isn't searched
+  if not text.endswith(')'):
+    return None
+  match = MUNICIPALITY_WITH_CODE.match(text)
+  if match is None:
+    return None
+  name = get_municipality_name(match.group(2))
+  if name is None:
+    return None
+  return (match.group(2), name)
+
+def get_cache_key(name, province):
+  return (fold_name(name), province)
+
+def get_known_municipality(municipality_name):
+  # Shared part of the lookups below. Return (municipality, name, province): the (code, name) of the
+  # municipality if it is known without searching (the text carries its code or the name is
+  # cached), otherwise None and the arguments to search it with find_municipality.
+  municipality = get_municipality_with_code(municipality_name)
+  if municipality is not None:
+    return municipality, None, None
+  name, province = split_province_hint(municipality_name)
+  return municipality_cache.get(get_cache_key(name, province)), name, province
+
+def cache_municipality(name, province, municipality, seconds):
+  LOOKUP_DURATION.observe('spain' if province is None else 'province', value=seconds)
+  municipality_cache.set(get_cache_key(name, province), municipality)
+
+def get_most_similar_municipality_code(municipality_name):
+  municipality, name, province = get_known_municipality(municipality_name)
+  if municipality is None:
+    started_at, finished_at, municipality = timed_call(find_municipality, (name, province))
+    cache_municipality(name, province, municipality, finished_at - started_at)
+  return municipality
+
+async def resolve_municipality_code(municipality_name):
+  # Same as get_most_similar_municipality_code, but the search runs in the worker pool
+  municipality, name, province = get_known_municipality(municipality_name)
+  if municipality is None:
+    municipality, seconds = await run_cpu_timed('municipality_lookup', find_municipality, name, province)
+    cache_municipality(name, province, municipality, seconds)
+  return municipality
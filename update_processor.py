@@ -0,0 +1,44 @@
+import asyncio
+import sys
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+  # Process up to `max_concurrent_updates` updates at the same time, but the updates of the same
+  # chat one after another, in the order they were received.
+  def __init__(self, max_concurrent_updates):
+    # The limit of the base class is taken before do_process_update, so the updates waiting for a
+    # busy chat would hold it and stall the other chats. It is disabled, the updates wait for their
+    # chat first and then for one of the `max_concurrent_updates` slots.
+    if max_concurrent_updates < 1:
+      raise ValueError('`max_concurrent_updates` must be a positive integer!')
+    super().__init__(sys.maxsize)
+    self.slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+    # Chat id -> [lock, number of updates using it]
+    self.chat_locks = {}
+
+  async def do_process_update(self, update, coroutine):
+    chat_id = None
+    if isinstance(update, Update) and update.effective_chat is not None:
+      chat_id = update.effective_chat.id
+    if chat_id is None:
+      async with self.slots:
+        await coroutine
+      return
+    chat_lock = self.chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+    chat_lock[1] += 1
+    try:
+      async with chat_lock[0]:
+        async with self.slots:
+          await coroutine
+    finally:
+      # Remove the lock when no other update of the chat is waiting for it
+      chat_lock[1] -= 1
+      if chat_lock[1] == 0:
+        del self.chat_locks[chat_id]
+
+  async def initialize(self):
+    pass
+
+  async def shutdown(self):
+    pass
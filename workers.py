@@ -0,0 +1,67 @@
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from metrics import Gauge, Histogram
+
+QUEUE_DURATION = Histogram('otempo_worker_queue_duration_seconds', 'Time waiting for a free worker', ['task'])
+RUN_DURATION = Histogram('otempo_worker_run_duration_seconds', 'Time running in a worker', ['task'])
+PENDING = Gauge('otempo_worker_pending', 'Calls sent to the workers and not finished yet', ['task'])
+
+def timed_call(function, args):
+  # Run in the worker. time.monotonic is system-wide, so it can be compared between processes.
+  started_at = time.monotonic()
+  result = function(*args)
+  return started_at, time.monotonic(), result
+
+class WorkerPool:
+  # Run CPU-bound functions in a thread or process pool, so they don't block the event loop.
+  # At most `max_workers + max_queued` calls are sent to the pool; the next callers wait until
+  # a call finishes. The functions and their arguments must be picklable for a process pool.
+  def __init__(self, kind='thread', max_workers=4, max_queued=64, initializer=None):
+    if kind == 'process':
+      self.executor = ProcessPoolExecutor(max_workers=max_workers, initializer=initializer)
+    else:
+      self.executor = ThreadPoolExecutor(max_workers=max_workers, initializer=initializer, thread_name_prefix='worker')
+    self.slots = asyncio.Semaphore(max_workers + max_queued)
+
+  async def run(self, task, function, *args):
+    submitted_at = time.monotonic()
+    PENDING.inc(task)
+    try:
+      async with self.slots:
+        loop = asyncio.get_running_loop()
+        started_at, finished_at, result = await loop.run_in_executor(self.executor, timed_call, function, args)
+    finally:
+      PENDING.dec(task)
+    QUEUE_DURATION.observe(task, value=started_at - submitted_at)
+    RUN_DURATION.observe(task, value=finished_at - started_at)
+    return result
+
+  def shutdown(self):
+    self.executor.shutdown(wait=False, cancel_futures=True)
+
+# Pool used by `run_cpu`. If it is not configured, the functions run in the event loop.
+pool = None
+
+def configure(kind='thread', max_workers=4, max_queued=64, initializer=None):
+  global pool
+  if pool is not None:
+    pool.shutdown()
+  pool = WorkerPool(kind, max_workers, max_queued, initializer)
+  return pool
+
+def shutdown():
+  global pool
+  if pool is not None:
+    pool.shutdown()
+    pool = None
+
+async def run_cpu(task, function, *args):
+  if pool is None:
+    return function(*args)
+  return await pool.run(task, function, *args)
+
+async def run_cpu_timed(task, function, *args):
+  # Same as run_cpu, but also return the seconds spent running the function, without the queue time
+  started_at, finished_at, result = await run_cpu(task, timed_call, function, args)
+  return result, finished_at - started_at